@@ -7,6 +7,30 @@ class Album():
         self.name = name
         self.songs: list[Song] = []
         self.expanded = False
+        self.index_songs()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["song_keys"]
+        del state["song_hashes"]
+        return state
+
+
+    def __setstate__(self, dict_):
+        self.__dict__ = dict_
+        self.index_songs()
+
+
+    def index_songs(self):
+        """Rebuild the lookups from exact artist and title, and from content hash, to the position of each song."""
+        self.song_keys: dict[tuple[str, str], int] = {}
+        self.song_hashes: dict[str, int] = {}
+        for count, song in enumerate(self.songs):
+            self.song_keys[song.get_key()] = count
+            content_hash = song.content_hash
+            if content_hash:
+                self.song_hashes[content_hash] = count
 
 
     def get_max_score(self) -> int:
@@ -28,6 +52,14 @@ class Album():
         return len(self.songs)
 
 
+    def get_next_song(self, song: Song) -> Song:
+        """Return the song after a song in the album, or None when it is the last."""
+        count = self.song_keys.get(song.get_key())
+        if count is None or count + 1 >= len(self.songs):
+            return None
+        return self.songs[count + 1]
+
+
     def find_song(self, title:str, artist:str = "") -> Song:
         """Return a song where the title and artist matches."""
         for song in self.songs:
@@ -35,27 +67,58 @@ class Album():
                 return song
 
 
-    def add_song(self, title:str, artist:str):
-        if song := self.find_song(title=title, artist=artist):
-            self.songs.append(song)
-
-
     def add_song(self, song:Song):
+        """Append a song, keeping the lookups by artist and title and by content hash up to date."""
         self.songs.append(song)
+        self.song_keys[song.get_key()] = len(self.songs) - 1
+        content_hash = song.content_hash
+        if content_hash:
+            self.song_hashes[content_hash] = len(self.songs) - 1
 
 
-    def add_update_song(self, song:Song) -> bool:
-        """Return True if a song with matching title and artist exists, saving the track ID."""
-        for count, existing_song in enumerate(self.songs):
-            if existing_song.artist.find(song.artist) >= 0 and existing_song.title.find(song.title) >= 0:
-                song.player_track_id = self.songs[count].player_track_id
-                self.songs[count] = song
-                print(f"Album updated with {song.get_name()}")
-                return True
+    def find_song_by_hash(self, content_hash: str) -> Song:
+        """Return the song with exactly the same note data or None."""
+        if content_hash in self.song_hashes:
+            return self.songs[self.song_hashes[content_hash]]
+        return None
 
-        self.songs.append(song)
+
+    def add_update_song(self, song:Song) -> bool:
+        """Return True if a song with matching title and artist or the same note data exists, saving the track ID.
+        A song with the same note data under another title is a duplicate and is not added."""
+        content_hash = song.content_hash
+        count = self.song_hashes.get(content_hash) if content_hash else None
+        if count is not None and self.songs[count].get_key() != song.get_key():
+            print(f"Album already contains {song.get_name()} as {self.songs[count].get_name()}")
+            return True
+
+        if count is None:
+            count = self.song_keys.get(song.get_key())
+
+        if count is not None:
+            if song.player_track_id != self.songs[count].player_track_id:
+                song.set_player_track(self.songs[count].player_track_id)
+            self.set_song(count, song)
+            print(f"Album updated with {song.get_name()}")
+            return True
+
+        self.add_song(song)
         return False
 
 
+    def set_song(self, song_id:int, song:Song):
+        old_song = self.songs[song_id]
+        if self.song_keys.get(old_song.get_key()) == song_id:
+            del self.song_keys[old_song.get_key()]
+        if self.song_hashes.get(old_song.content_hash) == song_id:
+            del self.song_hashes[old_song.content_hash]
+        self.songs[song_id] = song
+        self.song_keys[song.get_key()] = song_id
+        content_hash = song.content_hash
+        if content_hash:
+            self.song_hashes[content_hash] = song_id
+
+
     def delete_song(self, song_id:int):
         self.songs.remove(self.songs[song_id])
+        self.index_songs()
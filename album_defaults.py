@@ -1,7 +1,6 @@
 from album import Album
 from song import Song
 from song_book import SongBook
-from pathlib import Path
 from procedural_songs import generate_venue_album, TIER_CONFIGS
 
 
@@ -28,10 +27,12 @@ def setup_songbook_albums() -> SongBook:
         for song in songs:
             album.add_update_song(song)
 
-    album_name = "Real and Custom Songs"
-    songbook.add_update_from_midi(Path("music/Nursery Rhyme - MaryHadALittleLamb.mid"), 1, album_name)
-
     songbook.validate()
+
+    # Midi files in the music folder are kept up to date by the library watcher
+    if len(songbook.library_folders) == 0:
+        songbook.add_library_folder("music", "Real and Custom Songs")
+
     songbook.sort()
 
     return songbook
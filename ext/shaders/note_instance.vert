@@ -0,0 +1,83 @@
+#version 430
+
+// One quad for each note slot, read from the note buffers as per instance attributes.
+// Quads cover everything drawNote in notes.frag can draw for the note in its texture space and nothing for hidden slots.
+layout(location = 0) in vec4 NoteColour;
+layout(location = 1) in vec2 NotePosition;
+layout(location = 2) in vec2 NoteHat;
+layout(location = 3) in vec2 NoteExtra;
+layout(location = 4) in float NoteTie;
+layout(location = 5) in int NoteType;
+layout(location = 6) in int NoteDecoration;
+
+out vec2 OutTexCoord;
+flat out vec4 InstanceColour;
+flat out vec2 InstancePosition;
+flat out vec2 InstanceHat;
+flat out vec2 InstanceExtra;
+flat out float InstanceTie;
+flat out int InstanceType;
+flat out int InstanceDecoration;
+
+uniform float NoteWidth; // Width of a 32nd note, horizontal note geometry is stored in 32nds
+
+#define note_margin NOTE_MARGIN // Furthest a glyph, accidental or name is drawn from the note across the staff
+#define stalk_margin 0.25 // Furthest a blob, stalk with tail or accidental is drawn from the note up or down the staff
+#define note_type_rest_whole 7
+#define staff_note_spacing 0.03
+#define staff_pos_y 0.5
+
+void main()
+{
+    InstanceColour = NoteColour;
+    InstancePosition = NotePosition;
+    InstanceHat = NoteHat;
+    InstanceExtra = NoteExtra;
+    InstanceTie = NoteTie;
+    InstanceType = NoteType;
+    InstanceDecoration = NoteDecoration;
+
+    // Hidden slots collapse to a point and draw nothing
+    if (NoteColour.a <= 0.0)
+    {
+        OutTexCoord = vec2(0.0);
+        gl_Position = vec4(0.0, 0.0, 0.0, 1.0);
+        return;
+    }
+
+    vec2 p = (NotePosition + 1.0) * 0.5;
+
+    // Ties are ellipses centred between the tied notes, reaching 1.45 times their length squared along the staff
+    float tie_length = NoteTie * NoteWidth;
+    float tie_mid = p.x + tie_length * 0.5;
+    float tie_reach = tie_length * tie_length * 2.1025 + 0.004;
+    float left = min(p.x - note_margin, tie_mid - tie_reach);
+    float right = max(p.x + note_margin + max(NoteHat.x, 0.0) * NoteWidth, tie_mid + tie_reach);
+
+    // Stalks are lengthened by the extra geometry and hats slope, ties bow either side of the note
+    float reach = stalk_margin + abs(NoteExtra.y * 0.5) + abs(NoteHat.y) + tie_length * tie_length;
+    float bottom = p.y - reach;
+    float top = p.y + reach;
+
+    // Ledger lines join the note to the staff and rests are drawn on the staff wherever the note is
+    float staff_below = staff_pos_y - staff_note_spacing * 2.0;
+    float staff_above = staff_pos_y + staff_note_spacing * 9.0;
+    bottom = min(bottom, staff_above - 0.01);
+    top = max(top, staff_below + 0.01);
+    if (NoteType >= note_type_rest_whole)
+    {
+        bottom = min(bottom, staff_pos_y);
+        top = max(top, staff_pos_y + 0.25);
+    }
+#if NOTE_NAMES
+    else
+    {
+        top = 1.0;
+    }
+#endif
+
+    vec2 corner = vec2(float(gl_VertexID & 1), float(gl_VertexID >> 1));
+    vec2 uv = mix(vec2(left, bottom), vec2(right, top), corner);
+    OutTexCoord = vec2(uv.x, 1.0 - uv.y);
+    gl_Position = vec4(uv * 2.0 - 1.0, 0.0, 1.0);
+}
@@ -6,23 +6,58 @@ out vec4 outColour;
 uniform sampler2D SamplerTex;
 uniform vec4 Colour;
 uniform float DisplayRatio;
+uniform float NoteWidth; // Width of a 32nd note, horizontal note geometry is stored in 32nds
+uniform int Pass; // Draw the notes over LayerTex, only the staff and key signature, only LayerTex or only the notes
+uniform sampler2D LayerTex; // One texel per pixel of the viewport, the staff and key signature drawn in the static pass
+uniform ivec2 LayerOrigin; // Window position of the viewport's first pixel
+uniform vec2 ViewportSize; // Pixels in the viewport, texture coordinates are snapped to pixel centres so every pass shades a pixel the same
 
-uniform vec2 KeyPositions[NUM_KEY_SIG]; // 0-6 # Sharp, 7-13 b Flat
-uniform vec2 NotePositions[NUM_NOTES];
-uniform vec4 NoteColours[NUM_NOTES];
-uniform int NoteTypes[NUM_NOTES];
-uniform int NoteDecoration[NUM_NOTES];
-uniform vec2 NoteHats[NUM_NOTES];
-uniform float NoteTies[NUM_NOTES];
-uniform vec2 NoteExtra[NUM_NOTES];
+// State of one note slot that changes every frame, 32 bytes in std430
+struct NoteFrame
+{
+    vec4 colour;
+    vec2 position;
+};
+
+// Shape of one note slot set when a note is assigned to it, 32 bytes in std430
+struct NoteShape
+{
+    vec2 hat;
+    vec2 extra;
+    float tie;
+    int type;
+    int decoration;
+};
+
+// Note state in two buffers, sized at runtime so slots are added without compiling the shader again
+layout(std430, binding = NOTE_BUFFER_BINDING) readonly buffer NoteBuffer
+{
+    vec2 KeyPositions[NUM_KEY_SIG]; // 0-6 # Sharp, 7-13 b Flat
+    NoteFrame NoteFrames[];
+};
+
+layout(std430, binding = SHAPE_BUFFER_BINDING) readonly buffer NoteShapeBuffer
+{
+    NoteShape NoteShapes[];
+};
+
+// Slots of the notes that can reach each of NUM_BINS columns across the screen, BinSlots[BinStarts[c]] to BinSlots[BinStarts[c+1]-1]
+layout(std430, binding = BIN_BUFFER_BINDING) readonly buffer NoteBins
+{
+    int BinStarts[NUM_BINS + 1];
+    int BinSlots[];
+};
+
+#define pass_notes 0
+#define pass_static 1
+#define pass_layer 2
+#define pass_notes_only 3
 
 #define antialias 0.08
 #define note_size 0.1
 #define note_slant vec2(0.33,0.93496)
 #define note_slant_alt vec2(0.73, 0.73)
-#define note_spacing_32nd 0.015
 
-uniform int note_names;
 #define note_name_y 0.989
 #define note_name_size 0.035
 
@@ -290,7 +325,7 @@ float drawTie(in vec2 uv, in vec2 start, in vec2 end, bool above)
 }
 
 // hat-size denotes joining between eigth and sixteenth notes
-// hat_size.x component is the length,Y component is the end heigh difference
+// hat_size.x component is the length in 32nds,Y component is the end heigh difference
 // hat_size.x of zero and negative Y means the note has been tied into and does not require a tail
 
 // extra_geo denotes extending the stalk length of a note or forcing it's stalk a direction
@@ -299,12 +334,14 @@ float drawTie(in vec2 uv, in vec2 start, in vec2 end, bool above)
 float drawNote(in vec2 uv, in vec2 p, in int note_type, in int dec, in vec2 hat_size, in float tie_32s, in vec2 extra_geo) 
 {
     float letters = 0.0;
-    if (note_names > 0 && note_type < note_type_rest_whole)
+#if NOTE_NAMES
+    if (note_type < note_type_rest_whole)
     {
         float letf = 1.0 - ((p.y - staff_pos_y) / staff_note_spacing * 1.0);
         int leti = abs(int(letf)-5) % 7;
         letters = drawLetter(uv, p, leti);
     }
+#endif
 
     if (note_type == note_type_rest_whole)
     {
@@ -363,7 +400,7 @@ float drawNote(in vec2 uv, in vec2 p, in int note_type, in int dec, in vec2 hat_
     float tie = 0.0;
     if (tie_32s > 0.0)
     {
-        tie = drawTie(uv, p, p + vec2(note_spacing_32nd * tie_32s, 0.0), stalk_dir_down);
+        tie = drawTie(uv, p, p + vec2(NoteWidth * tie_32s, 0.0), stalk_dir_down);
     }
     
     if (note_type <= note_type_half)
@@ -456,7 +493,7 @@ float drawNote(in vec2 uv, in vec2 p, in int note_type, in int dec, in vec2 hat_
         float stalk_y_mult = stalk_dir_down ? -0.44 : 0.51;
         float hat_width = 0.012;
         vec2 hat_start = p + stalk_pos + vec2(stalk_width * -0.05, (stalk_size.y * stalk_y_mult) - hat_width);
-        vec2 hat_end = hat_start + hat_size + vec2(0.002, 0.0);
+        vec2 hat_end = hat_start + vec2(hat_size.x * NoteWidth, hat_size.y) + vec2(0.002, 0.0);
         hat = drawLineSquare(uv, hat_start, hat_end, hat_width, false);
     }
     
@@ -478,29 +515,67 @@ float drawStaff(in vec2 uv, in vec2 p)
 vec4 drawNotes(in vec2 uv)
 {
     vec4 all_notes = vec4(0.0);
-    for (int i = 0; i < NUM_NOTES; ++i)
+    int column = clamp(int(uv.x * float(NUM_BINS)), 0, NUM_BINS - 1);
+    for (int b = BinStarts[column]; b < BinStarts[column + 1]; ++b)
     {
-        vec2 note_pos = (NotePositions[i] + 1.0) * 0.5;
-        vec2 extra_geo = NoteExtra[i] * 0.5;
-        float tie = (NoteTies[i] + 1.0) * 0.5;
-        float note = drawNote(uv, note_pos, NoteTypes[i], NoteDecoration[i], NoteHats[i], tie, extra_geo);
-        float alpha = NoteColours[i].a;
-        all_notes = max(all_notes, vec4(note * NoteColours[i].rgb, note * alpha));
+        int slot = BinSlots[b];
+        NoteFrame f = NoteFrames[slot];
+        NoteShape n = NoteShapes[slot];
+        vec2 note_pos = (f.position + 1.0) * 0.5;
+        vec2 extra_geo = n.extra * 0.5;
+        float note = drawNote(uv, note_pos, n.type, n.decoration, n.hat, n.tie, extra_geo);
+        all_notes = max(all_notes, vec4(note * f.colour.rgb, note * f.colour.a));
     }
     return all_notes;
 }
 
+#if NOTE_INSTANCES
+// One quad for each note from note_instance.vert, its max blended into the layer so the result matches drawNotes
+flat in vec4 InstanceColour;
+flat in vec2 InstancePosition;
+flat in vec2 InstanceHat;
+flat in vec2 InstanceExtra;
+flat in float InstanceTie;
+flat in int InstanceType;
+flat in int InstanceDecoration;
+
 void main()
 {
-    vec2 uv = OutTexCoord;
+    vec2 uv = (floor(OutTexCoord * ViewportSize) + 0.5) / ViewportSize;
     uv.y = 1.0 - uv.y;
 
-    vec4 notes = drawNotes(uv);
-    float s = drawStaff(uv, staff_pos);
-    float k = drawKeySignature(uv);
+    vec2 note_pos = (InstancePosition + 1.0) * 0.5;
+    float note = drawNote(uv, note_pos, InstanceType, InstanceDecoration, InstanceHat, InstanceTie, InstanceExtra * 0.5);
+    outColour = vec4(note * InstanceColour.rgb, note * InstanceColour.a);
+}
+#else
+void main()
+{
+    vec2 uv = (floor(OutTexCoord * ViewportSize) + 0.5) / ViewportSize;
+    uv.y = 1.0 - uv.y;
 
-    vec4 staff = vec4(vec3(s * 0.079), s);
-    vec4 key = vec4(vec3(k * 0.08), k);
-    notes = max(key, notes);
-    outColour = max(staff, notes);
+    if (Pass == pass_static)
+    {
+        float s = drawStaff(uv, staff_pos);
+        float k = drawKeySignature(uv);
+
+        vec4 staff = vec4(vec3(s * 0.079), s);
+        vec4 key = vec4(vec3(k * 0.08), k);
+        outColour = max(staff, key);
+        return;
+    }
+    else if (Pass == pass_notes_only)
+    {
+        outColour = drawNotes(uv);
+        return;
+    }
+
+    vec4 layer = texelFetch(LayerTex, ivec2(gl_FragCoord.xy) - LayerOrigin, 0);
+    if (Pass == pass_layer)
+    {
+        outColour = layer;
+        return;
+    }
+    outColour = max(layer, drawNotes(uv));
 }
+#endif
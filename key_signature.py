@@ -1,18 +1,36 @@
+from note import Note
+
+
 class KeySignature:
     """Store and draw params of music key in reference to the midi meta-message for key signature."""
 
     NumAccidentals = 14
     SharpsAndFlats = {1: True, 3: True, 6: True, 8: True, 10: True, 13: True, 15: True, 18: True, 20: True}
-    LookupTableKeyToIndex = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 8, 'A': 9, 'B': 11}
+    LookupTableKeyToIndex = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+    TonicToIndex = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+    MajorKeys = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B'] # Fewest sharps or flats for each tonic
+    MinorKeys = ['Cm', 'C#m', 'Dm', 'Ebm', 'Em', 'Fm', 'F#m', 'Gm', 'G#m', 'Am', 'Bbm', 'Bm']
     OriginNote = 60
+    NumMidiNotes = 128
+    Tables = {} # Drawn note and accidental lookup tables for each key, built on first use
 
     def __init__(self):
         self._set_key('C')
         self.positions = [0.0] * KeySignature.NumAccidentals * 2
 
-    def set(self, key:str, note_positions: list):
+    def set(self, key:str, note_positions: list = None):
+        """Set the key, and the accidental drawing positions when staff note positions are supplied."""
         self._set_key(key)
-        self._set_accidental_positions(note_positions)
+        if note_positions is not None:
+            self._set_accidental_positions(note_positions)
+
+    @staticmethod
+    def transpose(key: str, semitones: int) -> str:
+        """Return the name of the major or minor key a number of semitones away."""
+        tonic = key.replace('m', '')
+        index = KeySignature.TonicToIndex[tonic[0]] + tonic.count('#') - tonic.count('b')
+        keys = KeySignature.MajorKeys if key.find("m") < 0 else KeySignature.MinorKeys
+        return keys[(index + semitones) % 12]
 
     def _set_key(self, key: str):
         self.sharps = []
@@ -33,6 +51,34 @@ class KeySignature:
         else:
             add_sharps_and_flats(KeySignature.LookupTableMinor[tonic])
 
+        if key not in KeySignature.Tables:
+            KeySignature.Tables[key] = self._build_tables()
+        self.notes_up, self.notes_down, self.alterations = KeySignature.Tables[key]
+
+    def _build_tables(self) -> tuple[list, list, list]:
+        """Tabulate the drawn note and alteration of every midi note for melodies going up and down,
+        along with the alteration the key signature gives each drawn note: 1 sharp, -1 flat or 0 natural.
+        Notes in the key signature are spelled as the key spells them in both directions."""
+        notes_up = []
+        notes_down = []
+        alterations = []
+        for note in range(KeySignature.NumMidiNotes):
+            note_lookup = note % 12
+            if (note_lookup - 1) % 12 in self.sharps and note > 0:
+                notes_up.append((note - 1, 1))
+                notes_down.append((note - 1, 1))
+            elif (note_lookup + 1) % 12 in self.flats and note < KeySignature.NumMidiNotes - 1:
+                notes_up.append((note + 1, -1))
+                notes_down.append((note + 1, -1))
+            elif note_lookup in KeySignature.SharpsAndFlats:
+                notes_up.append((note - 1, 1))
+                notes_down.append((note + 1, -1))
+            else:
+                notes_up.append((note, 0))
+                notes_down.append((note, 0))
+            alterations.append(1 if note_lookup in self.sharps else -1 if note_lookup in self.flats else 0)
+        return notes_up, notes_down, alterations
+
     
     def _set_accidental_positions(self, note_positions: list):
         self.positions = [0.0 for x in self.positions]
@@ -69,31 +115,31 @@ class KeySignature:
         set_key_pos(self.flats, KeySignature.NumAccidentals)
 
 
-    def get_accidental(self, note:int, prev_note:int, bar_accidentals:list) -> int:
+    def get_accidental(self, note:int, melody_dir_up:bool, bar_accidentals:list=None, playable_notes=None) -> tuple[int, int]:
         """Return the drawn note and the accidental character or None if extra notation is not required.
-           If a note is a flat or sharp and not included in the key signature it should be draw with an accidental.
-           If a note is included in a key signature's sharps or flats it should be drawn as the original note."""
-
-        melody_dir_up = prev_note < note
-        playable_note = note % 12
-        if playable_note in KeySignature.SharpsAndFlats:
-            if melody_dir_up:
-                mod_note = playable_note - 1
-                if mod_note in self.sharps:
-                    return note - 1, None
-                else:
-                    return note - 1, 1
-            else:
-                mod_note = playable_note + 1
-                if mod_note in self.flats:
-                    return note + 1, None
-                else:
-                    return note - 1, -1
-        elif playable_note in self.sharps:
-            return note, 0
-        elif playable_note in self.flats:
-            return note, 0
-        return note, None
+           Notes are spelled as the key signature spells them, other black keys are drawn as a sharp going up
+           and a flat coming down. A note that would be drawn outside the playable notes is drawn on its own line
+           or as a sharp instead. An accidental is drawn when the note differs from the key signature or an
+           earlier accidental on the same line in the bar.
+           Bar accidentals are three bitmasks of drawn notes indexed by alteration: natural, sharp and flat,
+           they are updated with each accidental drawn and should be cleared at the start of every bar."""
+        note_drawn, alteration = self.notes_up[note] if melody_dir_up else self.notes_down[note]
+        if playable_notes is not None and note_drawn not in playable_notes:
+            note_drawn, alteration = (note - 1, 1) if note % 12 in KeySignature.SharpsAndFlats else (note, 0)
+        current = self.alterations[note_drawn]
+        if bar_accidentals is not None:
+            note_bit = 1 << note_drawn
+            if (bar_accidentals[0] | bar_accidentals[1] | bar_accidentals[-1]) & note_bit:
+                current = 1 if bar_accidentals[1] & note_bit else -1 if bar_accidentals[-1] & note_bit else 0
+            if alteration != current:
+                bar_accidentals[0] &= ~note_bit
+                bar_accidentals[1] &= ~note_bit
+                bar_accidentals[-1] &= ~note_bit
+                bar_accidentals[alteration] |= note_bit
+
+        if alteration == current:
+            return note_drawn, None
+        return note_drawn, alteration
 
     def __str__(self):
         return self.key
@@ -133,3 +179,27 @@ class KeySignature:
         'D#':   ['D#', 'E#', 'F#', 'G#', 'A#', 'C#'], # 6 sharps
         'A#':   ['A#', 'B#', 'C#', 'D#', 'E#', 'F#', 'G#'], # 7 sharps
     }
+
+
+class BarAccidentals:
+    """Decide the drawn note and accidental of each note of a melody in time order, shared by the notation layout
+    and the song index so both count the same accidentals. Notes are spelled as the key signature spells them,
+    other black keys are sharp going up and flat coming down, or sharp at the top of the playable notes,
+    and each accidental lasts until the end of the bar."""
+    def __init__(self, key_signature: KeySignature, playable_notes):
+        self.key_signature = key_signature
+        self.playable_notes = playable_notes
+        self.prev_note = None
+        self.melody_dir_up = True
+        self.bar = -1
+        self.bar_accidentals = [0, 0, 0]
+
+    def get(self, note: int, time: int) -> tuple[int, int]:
+        """Return the drawn note and the accidental or None for the next playable note of the melody."""
+        if time // Note.BarLength != self.bar:
+            self.bar = time // Note.BarLength
+            self.bar_accidentals = [0, 0, 0]
+        if self.prev_note is not None and note != self.prev_note:
+            self.melody_dir_up = note > self.prev_note
+        self.prev_note = note
+        return self.key_signature.get_accidental(note, self.melody_dir_up, self.bar_accidentals, self.playable_notes)
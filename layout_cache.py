@@ -0,0 +1,91 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+class LayoutCache:
+    """Decorated notation layouts kept in memory and on disk so a song played before skips layout.
+    Layouts are keyed by song content hash, player track, transposition, key signature and layout version. The least recently
+    used layouts are evicted when either store grows past its size limit. Layouts can be read and stored
+    from any thread."""
+    PATH = os.path.join("ext", "layouts")
+    MaxMemoryNotes = 200000
+    MaxDiskBytes = 32 * 1024 * 1024
+
+    @staticmethod
+    def get_key(content_hash: str, track_id: int, key_signature: str, version: int, semitones: int = 0) -> str:
+        return f"{content_hash}_{track_id}_{semitones:+d}_{key_signature}_v{version}"
+
+    def __init__(self, path: str = PATH):
+        self.path = path
+        self.layouts: OrderedDict[str, list] = OrderedDict()
+        self.num_notes = 0
+        self.lock = threading.Lock()
+        self.memory_lock = threading.Lock()
+
+    def _get_file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key: str) -> list:
+        """Return the note records of a layout from memory or disk, None if it has not been cached."""
+        with self.memory_lock:
+            records = self.layouts.get(key)
+            if records is not None:
+                self.layouts.move_to_end(key)
+                return records
+
+        file = self._get_file(key)
+        if not os.path.exists(file):
+            return None
+        try:
+            with open(file, "rb") as layout_file:
+                records = pickle.load(layout_file)
+            os.utime(file)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print(f"Unable to read cached layout {file}: {e}")
+            return None
+        self._store(key, records)
+        return records
+
+    def put(self, key: str, records: list):
+        """Cache a complete layout, writing it to disk on a worker thread so drawing never waits."""
+        self._store(key, records)
+        threading.Thread(target=self._save, args=(key, records), daemon=True).start()
+
+    def _store(self, key: str, records: list):
+        if len(records) > LayoutCache.MaxMemoryNotes:
+            return
+        with self.memory_lock:
+            existing = self.layouts.pop(key, None)
+            if existing is not None:
+                self.num_notes -= len(existing)
+            self.layouts[key] = records
+            self.num_notes += len(records)
+            while self.num_notes > LayoutCache.MaxMemoryNotes:
+                _, evicted = self.layouts.popitem(last=False)
+                self.num_notes -= len(evicted)
+
+    def _save(self, key: str, records: list):
+        file = self._get_file(key)
+        temp_file = f"{file}.tmp"
+        with self.lock:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                with open(temp_file, "wb") as layout_file:
+                    pickle.dump(records, layout_file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_file, file)
+                self._evict_files()
+            except OSError as e:
+                print(f"Unable to write cached layout {file}: {e}")
+
+    def _evict_files(self):
+        """Remove the least recently used layout files until the cache fits on disk."""
+        with os.scandir(self.path) as entries:
+            files = [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in entries if e.is_file() and e.name.endswith(".pkl")]
+        total_size = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total_size <= LayoutCache.MaxDiskBytes:
+                break
+            os.remove(path)
+            total_size -= size
@@ -0,0 +1,206 @@
+"""Command line management of the song book that runs without a window, MIDI devices or shaders.
+
+Usage:
+    python -m library list
+    python -m library add <midi file or folder> [--track N] [--album NAME]
+    python -m library remove <"Artist - Title" or midi file path>
+    python -m library validate
+    python -m library reindex
+    python -m library analyse [--folder PATH] [--workers N]
+    python -m library search [text] [--range FIELD MIN MAX]
+
+Only the song data modules are imported, and only by the command that needs them,
+so this never pulls in OpenGL, GLFW or gamejam and works on a headless machine.
+"""
+
+import argparse
+import os
+import sys
+
+
+def _load_songbook(path: str):
+    from song_book import SongBook
+
+    SongBook.PATH = path
+    songbook = SongBook.load()
+    if songbook is None:
+        songbook = SongBook()
+    songbook.validate()
+    return songbook
+
+
+def _save_songbook(songbook):
+    from song_book import SongBook
+
+    SongBook.save(songbook)
+
+
+def library_list(songbook, args) -> int:
+    for album in songbook.albums:
+        print(f"{album.name} ({album.get_num_songs()} songs)")
+        for song in album.songs:
+            print(f"    {song.get_name()}  track {song.player_track_id}, {len(song.notes)} notes, {song.path}")
+    for folder, album_name in songbook.library_folders.items():
+        print(f"Library folder {folder} -> {album_name}")
+    return 0
+
+
+def library_add(songbook, args) -> int:
+    from album import Album
+    from song import Song
+    from library_watcher import LibraryWatcher
+
+    album_name = args.album or Album.DefaultName
+    if os.path.isdir(args.path):
+        songbook.add_library_folder(args.path, album_name)
+        LibraryWatcher(songbook).sync()
+    elif os.path.isfile(args.path):
+        songbook.library_removed.pop(os.path.normpath(args.path), None)
+        songbook.add_update_from_midi(args.path, Song.AutoTrack if args.track is None else args.track, album_name)
+    else:
+        print(f"Cannot find specified midi file or folder {args.path}!")
+        return 1
+    _save_songbook(songbook)
+    return 0
+
+
+def library_remove(songbook, args) -> int:
+    """Remove songs by name or file path. Library files stay removed until they change on disk."""
+    num_songs = songbook.get_num_songs()
+    removed = [(album, song) for album in songbook.albums for song in album.songs
+               if song.get_name() == args.song or (song.path and os.path.normpath(str(song.path)) == os.path.normpath(args.song))]
+    for album, song in removed:
+        path = str(song.path)
+        if path:
+            songbook.delete_song_by_path(path)
+            if path in songbook.library_index:
+                songbook.library_removed[path] = songbook.library_index[path]
+        elif song in album.songs:
+            album.delete_song(album.songs.index(song))
+
+    num_removed = num_songs - songbook.get_num_songs()
+    if num_removed == 0:
+        print(f"No song named or read from {args.song}!")
+        return 1
+    print(f"Removed {num_removed} song(s).")
+    _save_songbook(songbook)
+    return 0
+
+
+def library_validate(songbook, args) -> int:
+    """Report songs that cannot be played or whose files are missing."""
+    from note import Note
+
+    num_problems = 0
+    for album in songbook.albums:
+        for song in album.songs:
+            problems = []
+            if song.path and not os.path.exists(song.path):
+                problems.append("midi file is missing")
+            if len(song.notes) == 0:
+                problems.append(f"no notes on player track {song.player_track_id}")
+            else:
+                num_unplayable = sum(1 for n in song.notes if n.note < Note.LowestPlayable or n.note >= Note.LowestPlayable + Note.NumPlayable)
+                if num_unplayable > 0:
+                    problems.append(f"{num_unplayable} notes outside the staff range")
+            if not song.content_hash:
+                problems.append("no content hash, run reindex")
+            for problem in problems:
+                print(f"{album.name}: {song.get_name()}: {problem}")
+            num_problems += len(problems)
+    print(f"{songbook.get_num_songs()} songs checked, {num_problems} problems found.")
+    return 0 if num_problems == 0 else 1
+
+
+def library_reindex(songbook, args) -> int:
+    """Read every library folder and song file again, rebuilding the file and content hash indexes.
+    Each file is read once, library files that are not songs yet are read by a sync against the rebuilt index."""
+    from song import Song
+    from library_watcher import LibraryWatcher
+
+    for album in songbook.albums:
+        for count, song in enumerate(album.songs):
+            if song.path and os.path.exists(song.path):
+                new_song = Song()
+                new_song.from_midi_file(song.path, song.player_track_id)
+                new_song.score = song.score
+                album.songs[count] = new_song
+        album.index_songs()
+
+    song_paths = {str(song.path) for album in songbook.albums for song in album.songs}
+    files, _ = LibraryWatcher._scan(dict(songbook.library_folders), {})
+    songbook.library_index = {path: stat_key for path, (_, stat_key) in files.items()
+                              if path in song_paths or songbook.library_removed.get(path) == stat_key}
+    LibraryWatcher(songbook).sync()
+    _save_songbook(songbook)
+    print(f"Reindexed {songbook.get_num_songs()} songs.")
+    return 0
+
+
+def library_analyse(songbook, args) -> int:
+    """Write the searchable song index from every song in the song book or a folder of midi files."""
+    from song_index import SongIndex
+
+    index = SongIndex.build(songbook=songbook, folder=args.folder, max_workers=args.workers)
+    index.save(args.index)
+    print(f"Indexed {len(index.rows)} songs to {args.index}.")
+    return 0
+
+
+def library_search(songbook, args) -> int:
+    """List the songs in the song index matching text and falling in every metric range."""
+    from song_index import SongIndex
+
+    ranges = {}
+    for field, low, high in args.range:
+        if field not in SongIndex.Fields:
+            print(f"Unknown song index field {field}, choose from {', '.join(SongIndex.Fields)}")
+            return 1
+        ranges[field] = (float(low), float(high))
+
+    found = SongIndex.load(args.index).search(args.text, **ranges)
+    for row in found:
+        print(f"    {row['name']}  {row['album']}, key {row['key']}, {row['tempo_bpm']} bpm, {row['num_notes']} notes, {row['accidentals']} accidentals, {row['path']}")
+    print(f"{len(found)} songs found.")
+    return 0
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="library", description="Manage the MidiMaster song book without starting the game.")
+    parser.add_argument("--songbook", default=os.path.join("ext", "songs.pkl"), help="Path of the song book file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="List every album and song").set_defaults(func=library_list)
+
+    add = commands.add_parser("add", help="Add a midi file, or a folder to the library")
+    add.add_argument("path")
+    add.add_argument("--track", type=int, default=None, help="Player track, chosen automatically when not given")
+    add.add_argument("--album", default=None, help="Album to add to, the custom album when not given")
+    add.set_defaults(func=library_add)
+
+    remove = commands.add_parser("remove", help="Remove a song by name or midi file path")
+    remove.add_argument("song")
+    remove.set_defaults(func=library_remove)
+
+    commands.add_parser("validate", help="Check every song can be played").set_defaults(func=library_validate)
+    commands.add_parser("reindex", help="Read all song files again and rebuild the indexes").set_defaults(func=library_reindex)
+
+    analyse = commands.add_parser("analyse", help="Build the searchable song index using all CPU cores")
+    analyse.add_argument("--folder", default=None, help="Analyse a folder of midi files instead of the song book")
+    analyse.add_argument("--workers", type=int, default=None, help="Number of processes, one per core when not given")
+    analyse.add_argument("--index", default=os.path.join("ext", "song_index.json"), help="Path of the index file to write")
+    analyse.set_defaults(func=library_analyse)
+
+    search = commands.add_parser("search", help="Find songs in the song index written by analyse")
+    search.add_argument("text", nargs="?", default="", help="Part of a song or album name")
+    search.add_argument("--range", nargs=3, action="append", default=[], metavar=("FIELD", "MIN", "MAX"), help="Only songs with a metric in an inclusive range, eg: --range tempo_bpm 60 100")
+    search.add_argument("--index", default=os.path.join("ext", "song_index.json"), help="Path of the index file to read")
+    search.set_defaults(func=library_search)
+
+    args = parser.parse_args(argv)
+    songbook = _load_songbook(args.songbook)
+    return args.func(songbook, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
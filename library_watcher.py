@@ -0,0 +1,112 @@
+import os
+import queue
+import threading
+
+from song import Song
+from song_book import SongBook
+
+
+class LibraryWatcher:
+    """Keep the songbook up to date with folders of midi files.
+    Each file is indexed by modification time and size so only new, changed or deleted files
+    are read again. Polling runs on a worker thread so the render loop never waits on the disk,
+    the changes it finds are applied to the songbook on the calling thread in update()."""
+    PollInterval = 2.0
+    MidiExtensions = (".mid", ".midi")
+
+    def __init__(self, songbook: SongBook):
+        self.songbook = songbook
+        self.poll_timer = 0.0
+        self.changes = queue.Queue()
+        self.worker: threading.Thread = None
+
+    @staticmethod
+    def _scan(folders: dict, index: dict) -> tuple[dict, list]:
+        """Return the new or changed files keyed by path with album name and stat key, and the deleted paths."""
+        changed = {}
+        found = set()
+        for folder, album_name in folders.items():
+            if not os.path.isdir(folder):
+                # Keep the songs of folders that are temporarily unavailable
+                found.update(p for p in index if os.path.dirname(p) == folder)
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.lower().endswith(LibraryWatcher.MidiExtensions):
+                        continue
+                    path = os.path.join(folder, entry.name)
+                    stat = entry.stat()
+                    stat_key = (stat.st_mtime_ns, stat.st_size)
+                    found.add(path)
+                    if index.get(path) != stat_key:
+                        changed[path] = (album_name, stat_key)
+        deleted = [p for p in index if p not in found]
+        return changed, deleted
+
+    def _poll(self, folders: dict, index: dict):
+        """Read every new or changed file and queue the results along with deleted files.
+        Files that cannot be read are queued without a song so they are indexed and not read again until they change."""
+        changed, deleted = LibraryWatcher._scan(folders, index)
+        for path in deleted:
+            self.changes.put((path, None, None, None))
+        for path, (album_name, stat_key) in changed.items():
+            song = Song()
+            try:
+                song.from_midi_file(path)
+            except Exception as e:
+                print(f"Unable to read midi file {path}: {e}")
+                song = None
+            self.changes.put((path, album_name, stat_key, song))
+
+    def _forget_unused_files(self):
+        """Forget the indexed files that have no song, such as duplicates of a deleted song, so they are read again.
+        Files removed from the song book are kept."""
+        song_paths = {str(s.path) for album in self.songbook.albums for s in album.songs}
+        for path in [p for p in self.songbook.library_index if p not in song_paths and p not in self.songbook.library_removed]:
+            del self.songbook.library_index[path]
+
+    def _apply_changes(self) -> bool:
+        """Update the songbook and index with queued changes, returning True if any songs changed."""
+        songs_changed = False
+        while not self.changes.empty():
+            path, album_name, stat_key, song = self.changes.get_nowait()
+
+            # Removed files are only queued once they are deleted or change
+            self.songbook.library_removed.pop(path, None)
+            if stat_key is None:
+                self.songbook.library_index.pop(path, None)
+                if self.songbook.delete_song_by_path(path):
+                    self._forget_unused_files()
+            elif song is None:
+                self.songbook.delete_song_by_path(path)
+                self.songbook.library_index[path] = stat_key
+            else:
+                self.songbook.add_update_song(song, album_name)
+                self.songbook.library_index[path] = stat_key
+            songs_changed = True
+        return songs_changed
+
+    def is_polling(self) -> bool:
+        return self.worker is not None and self.worker.is_alive()
+
+    def sync(self) -> bool:
+        """Bring the songbook up to date with all library folders before returning."""
+        self._poll(dict(self.songbook.library_folders), dict(self.songbook.library_index))
+        return self._apply_changes()
+
+    def update(self, dt: float) -> bool:
+        """Start a background poll of the library folders periodically and apply any results.
+        Return True when songs were added, updated or removed."""
+        # Results of a finished poll are all queued before the next poll snapshots the index
+        polling = self.is_polling()
+        songs_changed = False if self.changes.empty() else self._apply_changes()
+
+        self.poll_timer += dt
+        if self.poll_timer >= LibraryWatcher.PollInterval and not polling:
+            self.poll_timer = 0.0
+            folders = dict(self.songbook.library_folders)
+            index = dict(self.songbook.library_index)
+            self.worker = threading.Thread(target=self._poll, args=(folders, index), daemon=True)
+            self.worker.start()
+
+        return songs_changed
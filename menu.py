@@ -270,6 +270,38 @@ class Menu():
                 item_pos.y -= SONG_SPACING
             item_pos.y -= ALBUM_SPACING
 
+    def _create_album_widgets(self):
+        num_albums = self.songbook.get_num_albums()
+        for i in range(num_albums):
+            album = self.songbook.albums[i]
+
+            album_name = WidgetFactory.create_text(
+                self.menus[Menus.SONGS], self.font,
+                album.name, 16, color=MenuConfig.TEXT_COLOR_NORMAL
+            )
+            album_widget = AlbumWidget(album_name, [])
+            self.song_albums.append(album_widget)
+
+            for song_index, song in enumerate(album.songs):
+                song_widget = self._create_song_widget(album, song, song_index)
+                album_widget.songs.append(song_widget)
+
+    def _delete_album_widgets(self):
+        gui = self.menus[Menus.SONGS]
+        for album_widget in self.song_albums:
+            gui.delete_widget(album_widget.name)
+            for song_widget in album_widget.songs:
+                for name in ["play", "score", "delete", "reload", "track_display", "track_down", "track_up"]:
+                    if hasattr(song_widget, name):
+                        gui.delete_widget(getattr(song_widget, name))
+        self.song_albums = []
+
+    def refresh_song_list(self):
+        """Recreate the album and song widgets after songs are added or removed from the songbook."""
+        self._delete_album_widgets()
+        self._create_album_widgets()
+        self.refresh_song_display()
+
     def get_song_score_text(self, song, mode: MusicMode = MusicMode.PERFORMANCE):
         cur_score = 0 if mode not in song.score else song.score[mode]
         return f"{round(cur_score)}/{round(song.get_max_score())} XP"
@@ -363,21 +395,7 @@ class Menu():
         self._update_career_display()
 
         # Create album and song widgets
-        num_albums = self.songbook.get_num_albums()
-        for i in range(num_albums):
-            album = self.songbook.albums[i]
-
-            album_name = WidgetFactory.create_text(
-                self.menus[Menus.SONGS], self.font,
-                album.name, 16, color=MenuConfig.TEXT_COLOR_NORMAL
-            )
-            album_widget = AlbumWidget(album_name, [])
-            self.song_albums.append(album_widget)
-
-            for song_index, song in enumerate(album.songs):
-                song_widget = self._create_song_widget(album, song, song_index)
-                album_widget.songs.append(song_widget)
-
+        self._create_album_widgets()
         self.refresh_song_display()
 
         # Top menu buttons
@@ -89,6 +89,10 @@ def song_play(**kwargs):
 
     menu.music.load(song)
 
+    # The next song or career set in the album is the most likely to be played after this one
+    if album is not None:
+        menu.music.preload(album.get_next_song(song))
+
     # Send program change to set player's instrument
     program_change = mido.Message("program_change", program=menu.songbook.player_instrument)
     menu.devices.output(program_change)
@@ -122,20 +126,20 @@ def song_delete(**kwargs):
     menu.menus[Menus.SONGS].delete_widget(widget.track_display)
     menu.menus[Menus.SONGS].delete_widget(widget.track_down)
     menu.menus[Menus.SONGS].delete_widget(widget.track_up)
-    album.delete_song(song)
+    album.delete_song(album.songs.index(song))
     menu._set_album_menu_pos()
 
 def song_track_up(**kwargs):
     widget=kwargs["widget"]
     song=kwargs["song"]
-    song.player_track_id += 1
+    song.set_player_track(song.player_track_id + 1)
     song.dirty = True
     widget.set_text(get_track_display_text(song), 9)
 
 def song_track_down(**kwargs):
     widget=kwargs["widget"]
     song=kwargs["song"]
-    song.player_track_id = max(song.player_track_id-1, 0)
+    song.set_player_track(song.player_track_id - 1)
     song.dirty = True
     widget.set_text(get_track_display_text(song), 9)
 
@@ -337,7 +341,7 @@ def _process_career_result(menu, game):
     # If bombed, regenerate the song
     if result["result"].value == "bombed" and not result["career_over"]:
         new_song = regenerate_set(tier, set_index)
-        album.songs[set_index] = new_song
+        album.set_song(set_index, new_song)
 
     # Clear the current career song
     menu.current_career_song = None
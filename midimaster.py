@@ -17,11 +17,14 @@ from score import (
     score_reset_ui, score_vfx, score_continuous_update
 )
 from album_defaults import setup_songbook_albums
+from library_watcher import LibraryWatcher
 from song import Song
 from song_book import SongBook
 from music import Music
 from staff import Staff
 from note_render import NoteRender
+from note_instance_render import NoteInstanceRender
+from note_strip_render import NoteStripRender
 from mido import Message
 from midi_devices import MidiDevices
 from menu_func import (
@@ -62,6 +65,11 @@ class MidiMaster(GameJam):
         self.player_notes_down: dict[int, float] = {}
         self.midi_notes: dict[int, float] = {} # The note value in the dictionary is the time to turn off
 
+        self.loop_start: int = -1 # Bar times in 32nds of the practice loop, -1 when not looping
+        self.loop_end: int = -1
+        self.loop_scores: list[int] = []
+        self.loop_score_start: float = 0.0
+
         self.reset()
 
     def reset(self):
@@ -75,9 +83,14 @@ class MidiMaster(GameJam):
         self.sent_notes = set()  # Track which note start times have been sent
         self.active_scorable_notes = {}
         self.music_running = False
+        self.loop_start = -1
+        self.loop_end = -1
+        self.loop_scores = []
+        self.loop_score_start = 0.0
 
         if self.music:
             self.score_max = self.music.song.get_max_score()
+            self.music.clear_loop(self.music_time)
 
         # Reset UI elements
         score_reset_ui(self)
@@ -89,26 +102,27 @@ class MidiMaster(GameJam):
         self.songbook = setup_songbook_albums()
         song_args = {
             "--song-add": "",
-            "--song-track": "1",
+            "--song-track": str(Song.AutoTrack),
             "--song-album": Album.DefaultName,
         }
         if MidiMaster.get_cmd_argument(song_args):
             song_path = os.path.join(".", song_args["--song-add"])
             song_track = int(song_args["--song-track"])
-            song_album = int(song_args["--song-album"])
+            song_album = song_args["--song-album"]
 
             if os.path.exists(song_path):
                 if os.path.isdir(song_path):
-                    for file in os.listdir(song_path):
-                        full_path = os.path.join(song_path, file)
-                        if os.path.isfile(full_path) and file.find("mid") >= 0:
-                            self.songbook.add_update_from_midi(full_path, song_track, song_album)
+                    self.songbook.add_library_folder(song_path, song_album)
                 elif os.path.isfile(song_path):
-                    self.songbook.add_update_from_midi(song_path, song_album)
+                    self.songbook.add_update_from_midi(song_path, song_track, song_album)
             else:
                 print(f"Cannot find specificed midi file or folder {song_path}! Exiting.")
                 exit()
 
+        # Read any new or changed midi files in the library folders
+        self.library = LibraryWatcher(self.songbook)
+        self.library.sync()
+
         # Connect midi inputs and outputs
         self.devices = MidiDevices()
         if self.songbook.input_device:
@@ -127,7 +141,11 @@ class MidiMaster(GameJam):
         self.menu.game = self  # Set game reference for menu callbacks
         self.font_game = Font(self.graphics, self.window, os.path.join("ext", "BlackMetalSans.ttf"))
         self.staff.prepare(self.menu.get_menu(Menus.GAME), self.textures)
-        self.note_render = NoteRender(self.graphics, self.staff, self.songbook)
+        note_render_type = NoteRender
+        for note_render_arg, render_type in (("--instanced-notes", NoteInstanceRender), ("--strip-notes", NoteStripRender)):
+            if MidiMaster.get_cmd_argument({note_render_arg: ""}):
+                note_render_type = render_type
+        self.note_render = note_render_type(self.graphics, self.staff, self.songbook)
         self.music = Music(self.graphics, self.note_render, self.staff)
         self.menu.prepare(self.font_game, self.music, self.songbook)
 
@@ -145,6 +163,9 @@ class MidiMaster(GameJam):
         if self.menu.running == False:
             self.quit()
 
+        if self.library.update(dt):
+            self.menu.refresh_song_list()
+
         _, game_draw_active = self.menu.is_menu_active(Menus.GAME)
         if not game_draw_active:
             return
@@ -184,14 +205,18 @@ class MidiMaster(GameJam):
         tempo_recip_60 = 1.0 / 60.0
         game_draw, _ = self.menu.is_menu_active(Menus.GAME)
         if game_draw:
+            # Wrap around the practice loop before drawing so the notes shown are from the start of the loop
+            if self.loop_end > 0 and self.music_time >= self.loop_end:
+                self.loop_restart()
+
             music_notes = self.music.draw(dt, self.music_time, self.note_width_32nd)
 
             music_time_advance = dt * Song.SDQNotesPerBeat * (tempo_recip_60 * self.music.tempo_bpm)
             if self.music_running:
                 self.music_time += music_time_advance
 
-            # End playback at the end of the song
-            if self.music_time >= self.music.song.notes[-1].time + 16:
+            # End playback at the end of the song, a practice loop past the last note wraps before the song can end
+            if self.loop_end <= 0 and self.music_time >= self.music.player_notes[-1].time + 16:
                 self.music_running = False
 
                 if self.mode not in self.music.song.score or self.score > self.music.song.score[self.mode]:
@@ -209,7 +234,7 @@ class MidiMaster(GameJam):
             tempo_factor = self.music.tempo_bpm / 60.0
             latency_offset_32nds = latency_seconds * Song.SDQNotesPerBeat * tempo_factor
 
-            for note in self.music.song.notes:
+            for note in self.music.player_notes:
                 note_pitch = note.note
                 note_start = note.time
                 note_end = note.time + note.length
@@ -273,7 +298,14 @@ class MidiMaster(GameJam):
 
             # Send note off messages for all the notes in the music
             for k in music_notes_off:
-                del music_notes[k]
+                # Repeated notes queue their note off times, the next starts once this one has ended
+                note_entry = music_notes[k]
+                if isinstance(note_entry, list) and len(note_entry) > 2:
+                    note_entry.pop(0)
+                elif isinstance(note_entry, list):
+                    music_notes[k] = note_entry[1]
+                else:
+                    del music_notes[k]
                 self.staff.note_off(k)
                 new_note_off = Message("note_off")
                 new_note_off.note = k
@@ -306,6 +338,13 @@ class MidiMaster(GameJam):
             # Show the play mode
             mode_string = "Performance" if self.mode == MusicMode.PERFORMANCE else "Pause & Learn"
             self.font_game.draw(f"{mode_string}", 16, Coord2d(0.5, 0.8), [0.6, 0.6, 0.6, 1.0])
+            if self.music.semitones != 0:
+                self.font_game.draw(f"Key: {self.staff.key_signature} ({self.music.semitones:+d})", 12, Coord2d(0.5, 0.7), [0.6, 0.6, 0.6, 1.0])
+            if self.loop_end > 0:
+                loop_string = f"Loop {len(self.loop_scores) + 1}"
+                if len(self.loop_scores) > 0:
+                    loop_string += f", last pass: {self.loop_scores[-1]}, best: {max(self.loop_scores)}"
+                self.font_game.draw(loop_string, 12, Coord2d(0.5, 0.75), [0.6, 0.6, 0.6, 1.0])
 
             # Show music time
             if GameSettings.DEV_MODE:
@@ -317,6 +356,65 @@ class MidiMaster(GameJam):
         self.devices.update()
 
 
+    def seek(self, music_time: float):
+        """Move to any time in the music, stopping all sounding notes so only the notes held over the new time play."""
+        if self.music.song is None or len(self.music.player_notes) == 0:
+            return
+        self.music_time = max(0.0, min(music_time, self.music.player_notes[-1].time))
+        self.stop_notes()
+        self.music.seek(self.music_time)
+
+
+    def transpose(self, semitones: int):
+        """Change the key the song is played and drawn in from the current time, keeping any practice loop."""
+        if self.music.song is None:
+            return
+        self.music.transpose(max(-Music.MaxTranspose, min(semitones, Music.MaxTranspose)))
+        if self.loop_end > 0:
+            self.music.set_loop(self.loop_start, self.loop_end)
+        self.seek(self.music_time)
+
+
+    def set_loop(self, start_time: int, end_time: int):
+        """Repeat the bars between two times, each pass through the loop is scored separately."""
+        self.loop_start = start_time
+        self.loop_end = end_time
+        self.loop_scores = []
+        self.loop_score_start = self.score
+        self.music.set_loop(start_time, end_time)
+
+
+    def clear_loop(self):
+        self.loop_start = -1
+        self.loop_end = -1
+        self.loop_scores = []
+        self.music.clear_loop(self.music_time)
+
+
+    def loop_restart(self):
+        """Return to the start of the practice loop keeping any time overrun so playback is seamless."""
+        self.loop_scores.append(round(self.score - self.loop_score_start))
+        self.loop_score_start = self.score
+        self.music_time = self.loop_start + (self.music_time - self.loop_end)
+        self.stop_notes()
+        self.music.loop_restart()
+
+
+    def stop_notes(self):
+        """Turn off every note sounding from the music and backing and clear note scoring state."""
+        for k in self.midi_notes:
+            self.staff.note_off(k)
+            new_note_off = Message("note_off")
+            new_note_off.note = k
+            self.devices.output(new_note_off)
+        for channel in range(16):
+            self.devices.output(Message("control_change", channel=channel, control=123, value=0)) # All notes off
+
+        self.midi_notes = {}
+        self.sent_notes = set()
+        self.active_scorable_notes = {}
+
+
     def end(self):
         self.songbook.input_device = self.devices.input_device_name
         self.songbook.output_device = self.devices.output_device_name
@@ -360,19 +458,45 @@ class MidiMaster(GameJam):
             self.note_width_32nd = max(0.0, self.note_width_32nd - (self.dt * 0.1))
 
         def music_time_fwd():
-            self.music_time += self.dt * 300.0
+            self.seek(self.music_time + self.dt * 300.0)
 
         def music_time_back():
-            self.music_time -= self.dt * 300.0
+            self.seek(self.music_time - self.dt * 300.0)
 
         def music_pause():
             self.music_running = not self.music_running
 
+        def loop_set_start():
+            self.loop_start = int(self.music_time // 32) * 32
+            if self.loop_end > self.loop_start:
+                self.set_loop(self.loop_start, self.loop_end)
+
+        def loop_set_end():
+            loop_end = (int(self.music_time // 32) + 1) * 32
+            if loop_end > self.loop_start:
+                self.set_loop(max(self.loop_start, 0), loop_end)
+            else:
+                self.clear_loop()
+
+        def loop_clear():
+            self.clear_loop()
+
+        def transpose_up():
+            self.transpose(self.music.semitones + 1)
+
+        def transpose_down():
+            self.transpose(self.music.semitones - 1)
+
         self.input.add_key_mapping(32, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, music_pause)  # space for Pause on keyup
         self.input.add_key_mapping(61, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, note_width_inc)  # + Add more space in a bar
         self.input.add_key_mapping(45, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, note_width_dec)  # - Add less space in a bar
         self.input.add_key_mapping(262, InputActionKey.ACTION_KEYREPEAT, InputActionModifier.NONE, music_time_fwd)  # -> Manually advance forward in time
         self.input.add_key_mapping(263, InputActionKey.ACTION_KEYREPEAT, InputActionModifier.NONE, music_time_back)  # -> Manually retreat backwards in time
+        self.input.add_key_mapping(91, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, loop_set_start)  # [ Start a practice loop at the current bar
+        self.input.add_key_mapping(93, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, loop_set_end)  # ] End the practice loop after the current bar
+        self.input.add_key_mapping(92, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, loop_clear)  # \ Stop looping
+        self.input.add_key_mapping(266, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, transpose_up)  # Page up Transpose up a semitone
+        self.input.add_key_mapping(267, InputActionKey.ACTION_KEYDOWN, InputActionModifier.NONE, transpose_down)  # Page down Transpose down a semitone
 
         def create_key_note(note_val: int, note_on: bool):
             if self.menu.is_menu_active(Menus.GAME):
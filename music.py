@@ -1,5 +1,10 @@
 
+import bisect
+import threading
+from itertools import accumulate
+
 import mido
+import numpy as np
 
 from gamejam.graphics import Graphics
 
@@ -8,6 +13,8 @@ from notes import Notes
 from note_render import NoteRender
 from staff import Staff
 from song import Song
+from note import Note
+from key_signature import KeySignature
 
 class Music:
     """A music class is a notes object populated from an on disk midi file.
@@ -17,6 +24,7 @@ class Music:
     ClickNote = 42 # Closed hi-hat, 39 = Hand clap, 56 = Cowbell
     ClickProgram = 113
     ClickChannel = 9
+    MaxTranspose = 12
 
     def __init__(self, graphics: Graphics, note_render: NoteRender, staff: Staff):
         self.graphics = graphics
@@ -28,42 +36,158 @@ class Music:
         self.ticks_per_beat = Song.SDQNotesPerBeat
         self.backing_index = {}
         self.backing_time = {}
+        self.backing_times = {}
+        self.backing_tracks = {}
+        self.player_notes = []
+        self.transpositions = {}
+        self.semitones = 0
+        self.loop_backing = {}
+        self.loop_time = 0
         self.click = True
         self.click_init = False
         self.last_click = -Music.ClickFreq + 0.01
         self.last_click_off = False
         self.backing_program_set = False
+        self.preload_song = None
+        self.preloaded = None
+        self.preloader: threading.Thread = None
 
     def load(self, song:Song):
         """ Post-process the raw note data of the music, adding rests and decoration"""
+        if song is self.preload_song and self.preloader is not None:
+            # Finish any remaining preparation rather than repeat it
+            self.preloader.join()
+        preloaded = self.preloaded
         self.reset()
         self.song = song
         self.tempo_bpm = song.tempo_bpm
         self.ticks_per_beat = song.ticks_per_beat
 
+        # Backing times planned by a preload are only valid while the backing tracks are unchanged
+        if preloaded is not None and preloaded[0] is song.backing_tracks:
+            self.backing_times = dict(preloaded[1])
         for id in self.song.backing_tracks:
             self.backing_index[id] = 0
             track = self.song.backing_tracks[id]
             self.backing_time[id] = track[0].time if track else 0.0
+            if id not in self.backing_times:
+                self.backing_times[id] = list(accumulate(msg.time for msg in track))
 
         self.backing_program_set = False
 
-        self.staff.key_signature.set(song.key_signature, self.note_positions)
-        self.notes.assign_notes(song.notes)
+        if not song.content_hash:
+            song.update_content_hash()
+        self.transpositions = {0: (song.notes, song.backing_tracks, song.key_signature)}
+        self.transpose(0)
+
+    def preload(self, song: Song):
+        """Prepare a song that is likely to be played next on a worker thread while the current song plays.
+        The song is hashed, its backing times planned and all of its notes laid out into the layout cache,
+        so loading it later only replays the cached layout."""
+        if song is None or song is self.song or song is self.preload_song:
+            return
+        self.preload_song = song
+        self.preloaded = None
+        self.preloader = threading.Thread(target=self._preload, args=(song,), daemon=True)
+        self.preloader.start()
+
+    def _preload(self, song: Song):
+        if not song.content_hash:
+            song.update_content_hash()
+        backing_tracks = song.backing_tracks
+        backing_times = {id: list(accumulate(msg.time for msg in track)) for id, track in backing_tracks.items()}
+        self.notes.prepare_layout(song.notes, song.content_hash, song.player_track_id, song.key_signature)
+        if song is self.preload_song:
+            self.preloaded = (backing_tracks, backing_times)
+
+    def transpose(self, semitones: int):
+        """Play and draw the song a number of semitones away from its written key.
+        Each transposition keeps its notes, backing and layout so switching back to it is instant."""
+        if semitones not in self.transpositions:
+            self.transpositions[semitones] = self._get_transposed(semitones)
+        self.semitones = semitones
+        self.player_notes, self.backing_tracks, key = self.transpositions[semitones]
+        self.staff.key_signature.set(key, self.note_positions)
+        self.notes.assign_notes(self.player_notes, self.song.content_hash, self.song.player_track_id, semitones)
+
+    def _get_transposed(self, semitones: int) -> tuple[list, dict, str]:
+        """Shift the pitch of the player notes and every backing note off the drum channel. Notes shifted
+        off the staff or out of the midi range are folded back in by octaves so none are dropped."""
+        notes = self.song.notes
+        pitches = np.fromiter((n.note for n in notes), dtype=np.int32, count=len(notes)) + semitones
+        pitches = Music._fold_octaves(pitches, Staff.OriginNote, Staff.OriginNote + Staff.NumNotes)
+        player_notes = [Note(pitch, n.time, n.length) for pitch, n in zip(pitches.tolist(), notes)]
+
+        backing_tracks = {}
+        for id, messages in self.song.backing_tracks.items():
+            indices = [i for i, msg in enumerate(messages) if msg.type in ("note_on", "note_off") and msg.channel != Song.DrumChannel]
+            pitches = np.fromiter((messages[i].note for i in indices), dtype=np.int32, count=len(indices)) + semitones
+            pitches = Music._fold_octaves(pitches, 0, KeySignature.NumMidiNotes)
+            track = list(messages)
+            for i, pitch in zip(indices, pitches.tolist()):
+                track[i] = messages[i].copy(note=pitch)
+            backing_tracks[id] = track
+
+        return player_notes, backing_tracks, KeySignature.transpose(self.song.key_signature, semitones)
+
+    @staticmethod
+    def _fold_octaves(pitches: np.ndarray, low: int, high: int) -> np.ndarray:
+        pitches = np.where(pitches < low, low + (pitches - low) % 12, pitches)
+        return np.where(pitches >= high, high - 12 + (pitches - high) % 12, pitches)
 
     def rewind(self):
         """Restore all the notes and backing in the music to the state just after loading."""
         self.notes.rewind()
         self.backing_index = {id: 0 for id in self.backing_index}
-        self.backing_time = {id: self.song.backing_tracks[id][0].time if self.song.backing_tracks[id] else 0.0 for id in self.backing_time}
+        self.backing_time = {id: self.backing_tracks[id][0].time if self.backing_tracks[id] else 0.0 for id in self.backing_time}
         self.last_click = -Music.ClickFreq + 0.01
         self.last_click_off = False
         self.backing_program_set = False
 
+    def seek(self, music_time: float):
+        """Move the notes and backing to any time by searching the note and backing event times."""
+        self.notes.seek(music_time)
+        music_time_in_ticks = (music_time / Song.SDQNotesPerBeat) * self.ticks_per_beat
+        for id, times in self.backing_times.items():
+            index = bisect.bisect_right(times, music_time_in_ticks)
+            self.backing_index[id] = index
+            self.backing_time[id] = times[index] if index < len(times) else music_time_in_ticks
+        self.last_click = music_time - (music_time % Music.ClickFreq)
+        self.last_click_off = False
+
+    def set_loop(self, start_time: int, end_time: int):
+        """Prepare the notes and backing cursors of a loop between two bar times so it restarts instantly."""
+        self.notes.set_loop(start_time, end_time)
+        start_time_in_ticks = (start_time / Song.SDQNotesPerBeat) * self.ticks_per_beat
+        self.loop_backing = {}
+        for id, times in self.backing_times.items():
+            index = bisect.bisect_right(times, start_time_in_ticks)
+            self.loop_backing[id] = (index, times[index] if index < len(times) else start_time_in_ticks)
+        self.loop_time = start_time
+
+    def clear_loop(self, music_time: float):
+        """Forget the loop, the notes after it are laid out again and the backing plays on."""
+        self.notes.clear_loop(music_time)
+        self.loop_backing = {}
+
+    def loop_restart(self):
+        self.notes.loop_restart()
+        for id, (index, time) in self.loop_backing.items():
+            self.backing_index[id] = index
+            self.backing_time[id] = time
+        self.last_click = self.loop_time - (self.loop_time % Music.ClickFreq)
+        self.last_click_off = False
+
     def reset(self):
         self.notes.reset()
         self.backing_index = {}
         self.backing_time = {}
+        self.backing_times = {}
+        self.backing_tracks = {}
+        self.player_notes = []
+        self.transpositions = {}
+        self.semitones = 0
+        self.loop_backing = {}
         self.last_click = -Music.ClickFreq + 0.01
         self.last_click_off = False
         self.click_init = False
@@ -74,7 +198,7 @@ class Music:
         music_time_in_ticks = (music_time / Song.SDQNotesPerBeat) * self.ticks_per_beat
 
         # Set backing track instrument before any other MIDI messages
-        if self.song and not self.backing_program_set and self.song.backing_tracks:
+        if self.song and not self.backing_program_set and self.backing_tracks:
             program_change = mido.Message("program_change", channel=Song.BackingChannel, program=Song.BackingProgram)
             devices.output(program_change)
             self.backing_program_set = True
@@ -100,27 +224,27 @@ class Music:
                 self.last_click = music_time - tick_recip
 
         def update_backing_track(id: int, ticks_time: float):
-            b_len = len(self.song.backing_tracks[id])
+            b_len = len(self.backing_tracks[id])
             b_index = self.backing_index[id]
             b_time = self.backing_time[id]
             if b_len == 0 or b_index >= b_len:
                 return
 
-            next_event = self.song.backing_tracks[id][b_index]
+            next_event = self.backing_tracks[id][b_index]
             while b_time <= ticks_time:
                 devices.output(next_event)
                 self.backing_index[id] += 1
                 b_index = self.backing_index[id]
                 if b_index >= b_len:
                     break
-                next_event = self.song.backing_tracks[id][b_index]
+                next_event = self.backing_tracks[id][b_index]
                 self.backing_time[id] += next_event.time
                 b_time = self.backing_time[id]
 
         if not self.song:
             return
 
-        for _, id in enumerate(self.song.backing_tracks):
+        for _, id in enumerate(self.backing_tracks):
             update_backing_track(id, music_time_in_ticks)
 
     def draw(self, dt: float, music_time: float, note_width: float) -> dict:
@@ -27,7 +27,12 @@ class NoteDecoration(Enum):
     DOTTED_SHARP = auto()
 
 class Note():
-    """Note is a POD style container for a note in a piece of music with representation."""
+    """Note is a compact POD style container for a note in a piece of music, see DecoratedNote for representation."""
+    __slots__ = ("note", "time", "length")
+
+    LowestPlayable = 40 # E2 on Piano, E String on Guitar, the lowest note on the staff
+    NumPlayable = 48 # Notes on the staff from LowestPlayable
+    BarLength = 32 # TODO Derive number of 32s in a bar from time signature
 
     NoteLengthTypes = {
         32: 1,    # Semibreve/Whole-note
@@ -63,11 +68,30 @@ class Note():
         return NoteType(Note.NoteLengthTypes[length] + int(NoteType.THIRTYSECOND.value))
 
     def __init__(self, note: int, time: int, length: int):
-        # These fields come from the music file and are required for playing
+        # These fields come from the music file and are required for playing, they are not changed after creation
         self.note = note
         self.time = time
         self.length = length
-        
+
+    def __reduce__(self):
+        return (Note, (self.note, self.time, self.length))
+
+    def __setstate__(self, state):
+        # Notes pickled before slots were added stored every field in a dict, drawing fields are no longer kept
+        if isinstance(state, tuple):
+            state = state[1] if state[0] is None else {**state[0], **state[1]}
+        self.note = state["note"]
+        self.time = state["time"]
+        self.length = state["length"]
+
+
+class DecoratedNote(Note):
+    """A note laid out for drawing in notation, only created for the notes being displayed."""
+    __slots__ = ("note_drawn", "pos", "type", "decoration", "hat", "tie", "extra")
+
+    def __init__(self, note: int, time: int, length: int):
+        super().__init__(note, time, length)
+
         # These fields are for drawing notation are post-processed
         """Hat denotes joining between eigth and sixteenth notes
         hat[0] component is the length, Y component is the end heigh difference
@@ -85,6 +109,9 @@ class Note():
         self.tie = 0.0
         self.extra = [0.0, 0.0]
 
+    def __reduce__(self):
+        return (DecoratedNote.from_record, (self.to_record(),))
+
     def is_decorated(self) -> bool: return self.type.value > 0
 
     def is_rest(self) -> bool: return self.type.value > NoteType.THIRTYSECOND.value
@@ -106,3 +133,26 @@ class Note():
 
     def decorate_rest(self, pos: list, type: NoteType):
         self.decorate(pos, type, None, None, None, None)
+
+    def to_record(self) -> tuple:
+        """Flatten a decorated note into plain values for caching."""
+        return (self.note, self.time, self.length, self.note_drawn, self.pos[0], self.pos[1], self.type.value, self.decoration.value,
+                self.hat[0], self.hat[1], self.tie, self.extra[0], self.extra[1])
+
+    @staticmethod
+    def from_record(record: tuple):
+        note = DecoratedNote(record[0], record[1], record[2])
+        note.note_drawn = record[3]
+        note.decorate([record[4], record[5]], NoteType(record[6]), NoteDecoration(record[7]), [record[8], record[9]], record[10], [record[11], record[12]])
+        return note
+
+
+# Lookup tables indexed by length in 32nds so notation layout does not walk NoteLengthTypes for each note
+Note.QuantizedLengths = [Note.get_quantized_length(length) for length in range(49)] # Lengths of 48 and over are dotted whole notes
+Note.QuantizedRests = [Note.get_quanitized_rest(length) for length in range(32)]
+Note.NoteTypes = {length: Note.get_note_type(length) for length in Note.NoteLengthTypes}
+Note.RestTypes = {length: Note.get_rest_type(length) for length in Note.NoteLengthTypes}
+Note.Decorations = {
+    (dotted, accidental): NoteDecoration((NoteDecoration.DOTTED.value if dotted else 0) + (0 if accidental is None else 2 + accidental))
+    for dotted in (False, True) for accidental in (None, -1, 0, 1)
+}
@@ -0,0 +1,104 @@
+import ctypes
+from pathlib import Path
+from OpenGL.GL import (
+    glGetUniformLocation,
+    glUniform1f,
+    glUniform2f,
+    glUseProgram,
+    glGetIntegerv,
+    glBindBuffer,
+    glGenVertexArrays, glBindVertexArray, glEnableVertexAttribArray, glVertexAttribPointer, glVertexAttribIPointer,
+    glVertexAttribDivisor, glDrawArraysInstanced,
+    GL_ARRAY_BUFFER, GL_FLOAT, GL_INT, GL_FALSE, GL_TRIANGLE_STRIP, GL_VIEWPORT,
+)
+
+from gamejam.graphics import Graphics
+
+from staff import Staff
+from note_render import NoteRender
+from song_book import SongBook
+
+
+class NoteInstanceRender(NoteRender):
+    """Draw each visible note as its own instanced quad instead of every note at every pixel of the window.
+    Per slot attributes are read straight from the note buffers as vertex buffers and each quad only covers
+    what its note can draw, so the cost scales with the notes on screen. Quads are max blended into a layer
+    that starts as the cached staff and key signature, the layer is then drawn with the notes sprite so the
+    window is blended exactly as NoteRender blends it."""
+    VertexShaderPath = Path(__file__).parent / "ext" / "shaders" / "note_instance.vert"
+
+    def __init__(self, graphics: Graphics, staff: Staff, songbook: SongBook):
+        self.instance_shader = None
+        self.vertex_array = None
+        self.attributes_set = False
+        super().__init__(graphics, staff, songbook)
+
+
+    def _create_shader(self):
+        """Compile the instanced notes program alongside the notes shader, which still draws the layers."""
+        self.instance_variants = {}
+        super()._create_shader()
+
+
+    def _select_shader(self):
+        """Use the instanced notes program compiled with or without note names to match the notes shader."""
+        super()._select_shader()
+        note_names = self.shader_note_names
+        if note_names not in self.instance_variants:
+            shader_substitutes = self._get_shader_substitutes()
+            shader_substitutes["NOTE_INSTANCES"] = 1
+            vertex_shader = Graphics.process_shader_source(Graphics.load_shader(NoteInstanceRender.VertexShaderPath), shader_substitutes)
+            note_shader = Graphics.process_shader_source(Graphics.load_shader(NoteRender.ShaderPath), shader_substitutes)
+            instance_shader = Graphics.create_program(vertex_shader, note_shader)
+            self.instance_variants[note_names] = (instance_shader, glGetUniformLocation(instance_shader, "NoteWidth"), glGetUniformLocation(instance_shader, "ViewportSize"))
+        self.instance_shader, self.instance_note_width_id, self.instance_viewport_size_id = self.instance_variants[note_names]
+
+
+    def _set_attributes(self):
+        """Point one instanced attribute at each field of the NoteFrame and NoteShape structs in the note buffers
+        in the order of note_instance.vert. Growing the buffers keeps the offsets and strides so the attributes are only set once."""
+        if self.vertex_array is None:
+            self.vertex_array = glGenVertexArrays(1)
+        glBindVertexArray(self.vertex_array)
+
+        attributes = [
+            (self.buffer_id, self.buffer, self.frame_fields, [self.note_colours, self.note_positions]),
+            (self.shape_buffer_id, self.shape_buffer, self.shape_fields, [self.note_hats, self.note_extra, self.note_ties, self.note_types, self.note_decoration]),
+        ]
+        location = 0
+        for buffer_id, buffer, fields, views in attributes:
+            glBindBuffer(GL_ARRAY_BUFFER, buffer_id)
+            stride = fields.strides[0]
+            for field in views:
+                offset = ctypes.c_void_p(field.ctypes.data - buffer.ctypes.data)
+                size = 1 if field.ndim == 1 else field.shape[1]
+                if field.dtype.kind == "i":
+                    glVertexAttribIPointer(location, size, GL_INT, stride, offset)
+                else:
+                    glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, offset)
+                glVertexAttribDivisor(location, 1)
+                glEnableVertexAttribArray(location)
+                location += 1
+
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.attributes_set = True
+
+
+    def _draw_notation(self, music_time: float):
+        """Max blend one quad for each slot into a copy of the staff layer then draw the layer to the window."""
+        viewport = [int(v) for v in glGetIntegerv(GL_VIEWPORT)]
+        self._draw_static(viewport)
+        if not self.attributes_set:
+            self._set_attributes()
+
+        layer_state = self._begin_layer(viewport)
+        glUseProgram(self.instance_shader)
+        glUniform1f(self.instance_note_width_id, self.note_width * 0.5)
+        glUniform2f(self.instance_viewport_size_id, viewport[2], viewport[3])
+        self._upload_changes()
+        glBindVertexArray(self.vertex_array)
+        glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, self.num_notes)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        self._end_layer(viewport, layer_state)
@@ -1,9 +1,20 @@
+import math
 from pathlib import Path
+import numpy as np
 from OpenGL.GL import (
     glGetUniformLocation,
-    glUniform1i, glUniform1iv,
+    glUniform1i,
     glUniform1f,
-    glUniform1fv, glUniform2fv, glUniform4fv,
+    glUniform2i,
+    glUniform2f,
+    glGenBuffers, glBindBuffer, glBindBufferBase, glBufferData, glBufferSubData,
+    glEnable, glDisable, glIsEnabled, glScissor, glGetIntegerv, glViewport,
+    glGenTextures, glBindTexture, glActiveTexture, glTexImage2D, glTexParameteri,
+    glGenFramebuffers, glBindFramebuffer, glFramebufferTexture2D, glClearBufferfv, glCopyImageSubData, glBlendEquation,
+    GL_SHADER_STORAGE_BUFFER, GL_DYNAMIC_DRAW, GL_STREAM_DRAW, GL_SCISSOR_TEST, GL_VIEWPORT, GL_BLEND,
+    GL_TEXTURE_2D, GL_TEXTURE0, GL_RGBA16F, GL_RGBA, GL_FLOAT, GL_NEAREST, GL_CLAMP_TO_EDGE,
+    GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T,
+    GL_FRAMEBUFFER, GL_FRAMEBUFFER_BINDING, GL_COLOR_ATTACHMENT0, GL_COLOR, GL_BLEND_EQUATION_RGB, GL_MAX,
 )
 
 from gamejam.coord import Coord2d
@@ -12,196 +23,534 @@ from gamejam.graphics import Graphics, Shader, ShaderType
 from gamejam.texture import SpriteTexture, Texture
 
 from staff import Staff
-from note import Note
+from note import DecoratedNote
 from key_signature import KeySignature
 from staff import Staff
 from song_book import SongBook
 
 
 class NoteRender:
-    """Draw 32 notes at a time for the entire game on the GPU."""
-    NumNotes = 32
+    """Draw all the notes for the entire game on the GPU, starting with 32 note slots and doubling them
+    whenever more notes are on screen at once, up to MaxNotes.
+    Note state is packed into two arrays shared with the shader as storage buffers of runtime size, so adding
+    slots only reallocates the buffers. Colours and positions change every frame and are uploaded as one range,
+    the shape of each note is uploaded only for the slots assigned since the last frame.
+    The screen is split into NumBins columns and the slots of the notes that can reach each column are
+    uploaded every frame as a second buffer, so each pixel only draws the notes near it.
+    The staff and key signature are drawn into a layer texture of the viewport's size by the same shader,
+    only again when the key, staff geometry or viewport size changes, and composited under the notes.
+    The shader is compiled with or without note names, each variant the first time it is shown."""
+    NumNotes = 32 # Starting number of note slots
+    MaxNotes = 512
+    MaxDisplayTime = 32 * 8 # Notes further ahead of the playhead are not shown whatever the note width
+    FrameFloats = 8 # Size of the NoteFrame struct in notes.frag in floats
+    ShapeFloats = 8 # Size of the NoteShape struct in notes.frag in floats
+    BufferBinding = 0
+    BinBufferBinding = 1
+    ShapeBufferBinding = 2
+    NumBins = 64
+    BinMargin = 0.08 # Furthest any part of a note other than its tie and hat is drawn from its position, in texture space
+    StalkMargin = 0.25 # Furthest a blob, stalk with tail or accidental is drawn from the note up or down the staff, in texture space
+    LedgerHeadroom = 2 # Staff spacings outside the highest and lowest notes kept for ledger lines, stalks and ties
+    ShaderPath = Path(__file__).parent / "ext" / "shaders" / "notes.frag"
+    PassNotes = 0 # Draw the notes over the layer texture
+    PassStatic = 1 # Draw only the staff and key signature
+    PassLayer = 2 # Draw only the layer texture
+    PassNotesOnly = 3 # Draw only the notes
+    LayerTextureUnit = 1
     BaseColour = 0.11
     HitColour = [BaseColour, 0.78, BaseColour, 1.0]
     MissColour = [0.78, BaseColour, BaseColour, 1.0]
 
     def __init__(self, graphics: Graphics, staff: Staff, songbook: SongBook):
+        self.graphics = graphics
         self.staff = staff
         self.songbook = songbook
         self.calibration = False
         self.display_ratio = graphics.display_ratio
         self.ref_c4_pos = [Staff.Pos[0], staff.note_positions[60]]
         self.note_width = Staff.NoteWidth32nd
+        self.num_notes = NoteRender.NumNotes
+        self._create_buffer()
         self.reset()
 
+        self.texture = Texture("")
+        self.static_texture = None
+        self.static_framebuffer = None
+        self.static_size = None
+        self.layer_texture = None
+        self.layer_framebuffer = None
+        self.layer_size = None
+        self._create_shader()
+
+        self.buffer_id = glGenBuffers(1)
+        self.shape_buffer_id = glGenBuffers(1)
+        self._allocate_buffers()
+        self.bin_buffer_id = glGenBuffers(1)
+
+
+    def _get_shader_substitutes(self) -> dict:
         # Notation shader draws from 0->1 on XY, left->right, down->up
-        shader_substitutes = {
-            "NUM_NOTES": NoteRender.NumNotes,
+        return {
+            "NOTE_INSTANCES": 0,
+            "NOTE_NAMES": 1 if self.songbook.show_note_names else 0,
+            "NOTE_MARGIN": NoteRender.BinMargin,
+            "#define stalk_margin 0.25": f"#define stalk_margin {NoteRender.StalkMargin}",
             "NUM_KEY_SIG": KeySignature.NumAccidentals,
+            "NOTE_BUFFER_BINDING": NoteRender.BufferBinding,
+            "SHAPE_BUFFER_BINDING": NoteRender.ShapeBufferBinding,
+            "BIN_BUFFER_BINDING": NoteRender.BinBufferBinding,
+            "NUM_BINS": NoteRender.NumBins,
             "#define staff_pos_x 0.0": f"#define staff_pos_x {0.5 + Staff.Pos[0] * 0.5}",
             "#define staff_pos_y 0.5": f"#define staff_pos_y {0.5 + Staff.Pos[1] * 0.5}",
             "#define staff_width 1.0": f"#define staff_width {Staff.Width * 0.5}",
             "#define staff_note_spacing 0.03": f"#define staff_note_spacing {Staff.NoteSpacing * 0.5}"
         }
-        note_shader_path = Path(__file__).parent / "ext" / "shaders" / "notes.frag"
-        note_shader = Graphics.process_shader_source(Graphics.load_shader(note_shader_path), shader_substitutes)
-        self.shader = Graphics.create_program(graphics.builtin_shader(Shader.TEXTURE, ShaderType.VERTEX), note_shader)
-        
-        self.texture = Texture("")
-        self.sprite = SpriteTexture(graphics, self.texture, [1.0, 1.0, 1.0, 1.0], Coord2d(), Coord2d(2.0, 2.0), self.shader)
 
+
+    def _create_shader(self):
+        """Compile the notes shader once, the note buffers it reads grow without compiling it again."""
+        self.shader_variants = {}
+        self.shader_note_names = None
+        self._select_shader()
+
+        # Staff geometry is compiled into the shader so the static layer is drawn again with it
+        self.static_key_positions = None
+
+
+    def _select_shader(self):
+        """Use the notes shader variant that matches whether note names are shown, compiling it the first time.
+        Note names are compiled in or out rather than tested for every note at every pixel."""
+        note_names = self.songbook.show_note_names
+        if note_names == self.shader_note_names:
+            return
+
+        if note_names not in self.shader_variants:
+            note_shader = Graphics.process_shader_source(Graphics.load_shader(NoteRender.ShaderPath), self._get_shader_substitutes())
+            shader = Graphics.create_program(self.graphics.builtin_shader(Shader.TEXTURE, ShaderType.VERTEX), note_shader)
+            sprite = SpriteTexture(self.graphics, self.texture, [1.0, 1.0, 1.0, 1.0], Coord2d(), Coord2d(2.0, 2.0), shader)
+            self.shader_variants[note_names] = (shader, sprite)
+
+        self.shader, self.sprite = self.shader_variants[note_names]
+        self.shader_note_names = note_names
         self.display_ratio_id = glGetUniformLocation(self.shader, "DisplayRatio")
+        self.viewport_size_id = glGetUniformLocation(self.shader, "ViewportSize")
         self.music_time_id = glGetUniformLocation(self.shader, "MusicTime")
-        self.note_names_id = glGetUniformLocation(self.shader, "note_names")
-        self.key_positions_id = glGetUniformLocation(self.shader, "KeyPositions")
-        self.note_positions_id = glGetUniformLocation(self.shader, "NotePositions")
-        self.note_colours_id = glGetUniformLocation(self.shader, "NoteColours")
-        self.note_types_id = glGetUniformLocation(self.shader, "NoteTypes")
-        self.note_decoration_id = glGetUniformLocation(self.shader, "NoteDecoration")
-        self.note_hats_id = glGetUniformLocation(self.shader, "NoteHats")
-        self.note_ties_id = glGetUniformLocation(self.shader, "NoteTies")
-        self.note_extra_id = glGetUniformLocation(self.shader, "NoteExtra")
+        self.note_width_id = glGetUniformLocation(self.shader, "NoteWidth")
+        self.pass_id = glGetUniformLocation(self.shader, "Pass")
+        self.layer_tex_id = glGetUniformLocation(self.shader, "LayerTex")
+        self.layer_origin_id = glGetUniformLocation(self.shader, "LayerOrigin")
+
+
+    def _create_buffer(self):
+        """Lay out the note buffers in std430 order with every field a view into one of two arrays: the key
+        signature positions then one NoteFrame struct for each slot, and one NoteShape struct for each slot.
+        Larger buffers start with the same layout as smaller ones."""
+        num_notes = self.num_notes
+        key_end = KeySignature.NumAccidentals * 2
+        self.buffer = np.zeros(key_end + num_notes * NoteRender.FrameFloats, dtype=np.float32)
+        self.key_positions = self.buffer[:key_end].reshape(KeySignature.NumAccidentals, 2)
+        self.frame_fields = self.buffer[key_end:].reshape(num_notes, NoteRender.FrameFloats)
+        self.note_colours = self.frame_fields[:, 0:4]
+        self.note_positions = self.frame_fields[:, 4:6]
+        self.shape_buffer = np.zeros(num_notes * NoteRender.ShapeFloats, dtype=np.float32)
+        self.shape_fields = self.shape_buffer.reshape(num_notes, NoteRender.ShapeFloats)
+        self.note_hats = self.shape_fields[:, 0:2]
+        self.note_extra = self.shape_fields[:, 2:4]
+        self.note_ties = self.shape_fields[:, 4]
+        self.note_types = self.shape_fields[:, 5].view(np.int32)
+        self.note_decoration = self.shape_fields[:, 6].view(np.int32)
+
+
+    def _allocate_buffers(self):
+        """Size both storage buffers to the note arrays and fill them."""
+        for buffer_id, data in [(self.buffer_id, self.buffer), (self.shape_buffer_id, self.shape_buffer)]:
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, buffer_id)
+            glBufferData(GL_SHADER_STORAGE_BUFFER, data.nbytes, data, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
 
 
     def reset(self):
-        self.note = -1
-        self.notes_assigned = 0
-        self.notes = [None] * NoteRender.NumNotes
-        self.note_positions = [0.0] * NoteRender.NumNotes * 2
-        self.note_colours = [0.0] * NoteRender.NumNotes * 4
-        self.note_types = [0] * NoteRender.NumNotes
-        self.note_decoration = [0] * NoteRender.NumNotes
-        self.note_hats = [0.0] * NoteRender.NumNotes * 2
-        self.note_ties = [0.0] * NoteRender.NumNotes
-        self.note_extra = [0.0] * NoteRender.NumNotes * 2
-        
+        self.notes = [None] * self.num_notes
+        self.free_slots = list(range(self.num_notes - 1, -1, -1)) # Lowest slots are assigned first
+        self.slot_time = np.zeros(self.num_notes, dtype=np.float64)
+        self.slot_length = np.zeros(self.num_notes, dtype=np.float64)
+        self.slot_pitch = np.zeros(self.num_notes, dtype=np.int32)
+        self.slot_active = np.zeros(self.num_notes, dtype=bool)
+        self.slot_sounding = np.zeros(self.num_notes, dtype=bool) # Active and not a rest
+        self.slot_waiting = np.zeros(self.num_notes, dtype=bool) # Sounding and not yet played
+        self.buffer.fill(0.0)
+        self.shape_buffer.fill(0.0)
+        self.key_positions_set = None
+        self.dirty_slots = [-1, -1]
+
+
+    def grow(self) -> bool:
+        """Double the number of note slots keeping every assigned note in its slot, False when at the maximum."""
+        if self.num_notes >= NoteRender.MaxNotes:
+            return False
+
+        old_num_notes = self.num_notes
+        old_buffer = self.buffer
+        old_shape_buffer = self.shape_buffer
+        self.num_notes = min(self.num_notes * 2, NoteRender.MaxNotes)
+        self._create_buffer()
+        self.buffer[:len(old_buffer)] = old_buffer
+        self.shape_buffer[:len(old_shape_buffer)] = old_shape_buffer
+
+        def extend(slots: np.ndarray) -> np.ndarray:
+            return np.concatenate((slots, np.zeros(self.num_notes - old_num_notes, dtype=slots.dtype)))
+
+        self.notes.extend([None] * (self.num_notes - old_num_notes))
+        self.free_slots.extend(range(self.num_notes - 1, old_num_notes - 1, -1))
+        self.slot_time = extend(self.slot_time)
+        self.slot_length = extend(self.slot_length)
+        self.slot_pitch = extend(self.slot_pitch)
+        self.slot_active = extend(self.slot_active)
+        self.slot_sounding = extend(self.slot_sounding)
+        self.slot_waiting = extend(self.slot_waiting)
+        self._allocate_buffers()
+        return True
+
+
+    def _set_dirty(self, slot: int):
+        """Extend the range of slots whose shapes need uploading."""
+        if self.dirty_slots[0] < 0:
+            self.dirty_slots = [slot, slot + 1]
+        else:
+            self.dirty_slots = [min(self.dirty_slots[0], slot), max(self.dirty_slots[1], slot + 1)]
+
+
+    @staticmethod
+    def _upload(data: np.ndarray, buffer: np.ndarray):
+        """Copy a contiguous part of a note array to the same offset in the storage buffer bound from it."""
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, data.ctypes.data - buffer.ctypes.data, data.nbytes, data)
+
+
+    def _upload_changes(self):
+        """Upload the positions and colours of every slot, the key signature positions when they changed
+        and the shapes of the slots assigned since the last upload."""
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, NoteRender.BufferBinding, self.buffer_id)
+        key_positions = self.staff.key_signature.positions
+        if key_positions is not self.key_positions_set:
+            self.key_positions_set = key_positions
+            self.key_positions[:] = np.reshape(key_positions, self.key_positions.shape)
+            NoteRender._upload(self.key_positions, self.buffer)
+        NoteRender._upload(self.frame_fields, self.buffer)
+
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, NoteRender.ShapeBufferBinding, self.shape_buffer_id)
+        if self.dirty_slots[0] >= 0:
+            start, end = self.dirty_slots
+            NoteRender._upload(self.shape_fields[start:end], self.shape_buffer)
+            self.dirty_slots = [-1, -1]
+
 
     def _assign_calibration_notes(self):
         """Add five notes with separate colours to each extent of the screen."""
 
         self.calibration = True
-        npos = 0
-        cpos = 0
-
-        def add_calibration_note(npos, cpos, pos: list, col: list):
-            self.note +=1
-            self.notes_assigned += 1
-            self.notes[self.note] = Note(60, 0, 32)
-            self.note_positions[npos] = pos[0]
-            self.note_positions[npos + 1] = pos[1]
-            self.note_colours[cpos] = col[0]
-            self.note_colours[cpos+1] = col[1]
-            self.note_colours[cpos+2] = col[2]
-            self.note_colours[cpos+3] = col[3]
-            self.note_types[self.note] = 1
-            return npos + 2, cpos + 4
-
-        npos, cpos = add_calibration_note(npos, cpos, [-1.0, -1.0], [1.0, 0.0, 0.0, 1.0])
-        npos, cpos = add_calibration_note(npos, cpos, [1.0, -1.0], [0.0, 1.0, 0.0, 1.0])
-        npos, cpos = add_calibration_note(npos, cpos, [1.0, 1.0], [0.0, 0.0, 1.0, 1.0])
-        npos, cpos = add_calibration_note(npos, cpos, [-1.0, 1.0], [1.0, 1.0, 0.0, 1.0])
-        npos, cpos = add_calibration_note(npos, cpos, [0.0, 0.0], [1.0, 0.0, 1.0, 1.0])
+
+        def add_calibration_note(pos: list, col: list):
+            slot = self._allocate(DecoratedNote(60, 0, 32))
+            self.note_positions[slot] = pos
+            self.note_colours[slot] = col
+            self.note_types[slot] = 1
+            self._set_dirty(slot)
+
+        add_calibration_note([-1.0, -1.0], [1.0, 0.0, 0.0, 1.0])
+        add_calibration_note([1.0, -1.0], [0.0, 1.0, 0.0, 1.0])
+        add_calibration_note([1.0, 1.0], [0.0, 0.0, 1.0, 1.0])
+        add_calibration_note([-1.0, 1.0], [1.0, 1.0, 0.0, 1.0])
+        add_calibration_note([0.0, 0.0], [1.0, 0.0, 1.0, 1.0])
 
 
     def get_num_free_notes(self):
-        return NoteRender.NumNotes - self.notes_assigned
-        
+        return len(self.free_slots)
 
-    def assign(self, note: Note):
-        """Add a new note to an empty note slot."""
-
-        search = 0
-        new_note = (self.note + 1) % NoteRender.NumNotes
-        while self.notes[new_note] is not None:
-            search += 1
-            new_note = (self.note + search) % NoteRender.NumNotes
-            if search >= NoteRender.NumNotes // 2:
-                if GameSettings.DEV_MODE:
-                    print(f"Note render has run out of active notes!")
-                break
+
+    def _allocate(self, note: DecoratedNote) -> int:
+        """Take the most recently freed slot for a note."""
+        slot = self.free_slots.pop()
+        self.notes[slot] = note
+        self.slot_active[slot] = True
+        return slot
         
-        self.note = new_note
-        self.notes_assigned += 1
-        self.notes[self.note] = note
+
+    def assign(self, note: DecoratedNote):
+        """Add a new note to an empty note slot, adding more slots when they are all in use."""
+
+        if len(self.free_slots) == 0 and not self.grow():
+            if GameSettings.DEV_MODE:
+                print(f"Note render has run out of active notes!")
+            return
+
+        slot = self._allocate(note)
+        self.slot_time[slot] = note.time
+        self.slot_length[slot] = note.length
+        self.slot_pitch[slot] = note.note
+        self.slot_sounding[slot] = not note.is_rest()
+        self.slot_waiting[slot] = not note.is_rest()
 
         col = [NoteRender.BaseColour, NoteRender.BaseColour, NoteRender.BaseColour, 1.0]
 
-        npos = self.note * 2
-        cpos = self.note * 4
-        self.note_positions[npos] = note.pos[0]
-        self.note_positions[npos + 1] = note.pos[1]
-        self.note_colours[cpos] = col[0]
-        self.note_colours[cpos+1] = col[1]
-        self.note_colours[cpos+2] = col[2]
-        self.note_colours[cpos+3] = col[3]
-        self.note_types[self.note] = int(note.type.value)
-        self.note_decoration[self.note] = int(note.decoration.value)
-        self.note_hats[npos] = note.hat[0] * self.note_width * 0.5 # TODO Move note_width into a uniform so hats join up when zooming
-        self.note_hats[npos + 1] = note.hat[1]
-        self.note_ties[self.note] = note.tie
-        self.note_extra[npos] = note.extra[0]
-        self.note_extra[npos + 1] = note.extra[1]
+        self.note_positions[slot] = note.pos
+        self.note_colours[slot] = col
+        self.note_types[slot] = int(note.type.value)
+        self.note_decoration[slot] = int(note.decoration.value)
+        self.note_hats[slot] = note.hat
+        self.note_ties[slot] = note.tie
+        self.note_extra[slot] = note.extra
+        self._set_dirty(slot)
+
+
+    def rebase(self, time: float):
+        """Move every assigned note back in time, as when the music time is moved back to repeat a passage."""
+        self.slot_time -= time
+
+
+    def _get_reach(self, slots: np.ndarray, width_32nd: float) -> tuple[np.ndarray, np.ndarray]:
+        """Return how far left and right of their positions in texture space the notes in slots can draw.
+        Bounds are conservative as any part of a note outside them would be clipped."""
+        # Ties are ellipses centred between the tied notes reaching the square of 1.45 times their length either side
+        tie_length = self.note_ties[slots] * width_32nd
+        tie_mid = tie_length * 0.5
+        tie_reach = (tie_length * 1.45) ** 2 + 0.004
+        left = np.minimum(-NoteRender.BinMargin, tie_mid - tie_reach)
+        right = np.maximum(NoteRender.BinMargin + np.maximum(self.note_hats[slots, 0], 0.0) * width_32nd, tie_mid + tie_reach)
+        return left, right
+
+
+    def _get_stalk_reach(self, slots: np.ndarray, width_32nd: float) -> np.ndarray:
+        """Return how far up and down the staff in texture space the notes in slots can draw, the same bound
+        note_instance.vert sizes each quad with. Stalks are lengthened by the extra geometry and hats slope."""
+        tie_length = self.note_ties[slots] * width_32nd
+        return NoteRender.StalkMargin + np.abs(self.note_extra[slots, 1] * 0.5) + np.abs(self.note_hats[slots, 1]) + tie_length * tie_length
+
+
+    def _get_bins(self, note_width: float, visible: np.ndarray = None) -> np.ndarray:
+        """Return the start of each column's entries followed by the slots of the visible notes that can reach
+        that column. Every note with alpha is binned unless the slots to draw are given."""
+        if visible is None:
+            visible = np.flatnonzero(self.note_colours[:, 3] > 0.0)
+        pos_x = (self.note_positions[visible, 0] + 1.0) * 0.5
+        reach_left, reach_right = self._get_reach(visible, note_width * 0.5)
+        left = pos_x + reach_left
+        right = pos_x + reach_right
+
+        on_screen = (right >= 0.0) & (left < 1.0)
+        visible = visible[on_screen]
+        first = np.clip(np.floor(left[on_screen] * NoteRender.NumBins), 0, NoteRender.NumBins - 1).astype(np.int32)
+        last = np.clip(np.floor(right[on_screen] * NoteRender.NumBins), 0, NoteRender.NumBins - 1).astype(np.int32)
+
+        # One entry for every column each note covers, sorted by column keeping slot order
+        counts = last - first + 1
+        ends = np.cumsum(counts)
+        columns = np.repeat(first, counts) + np.arange(ends[-1] if len(ends) > 0 else 0) - np.repeat(ends - counts, counts)
+        order = np.argsort(columns, kind="stable")
+        starts = np.searchsorted(columns[order], np.arange(NoteRender.NumBins + 1))
+        return np.concatenate((starts, np.repeat(visible, counts)[order])).astype(np.int32)
+
+
+    def _upload_bins(self, bins: np.ndarray):
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, NoteRender.BinBufferBinding, self.bin_buffer_id)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, bins.nbytes, bins, GL_STREAM_DRAW)
+
+
+    @staticmethod
+    def _create_target(texture: int, framebuffer: int, width: int, height: int, internal_format: int = GL_RGBA16F) -> tuple[int, int]:
+        """Allocate a layer texture attached to a framebuffer, reusing existing texture and framebuffer names when given.
+        Texels are floats by default as layers are combined with the notes using max before any clamping."""
+        if texture is None:
+            texture = glGenTextures(1)
+            framebuffer = glGenFramebuffers(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, GL_RGBA, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        previous_framebuffer = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_framebuffer)
+        return texture, framebuffer
+
+
+    def _bind_layer(self, texture: int, viewport: list):
+        """Set the layer texture the notes shader reads for the pixels of the viewport."""
+        glActiveTexture(GL_TEXTURE0 + NoteRender.LayerTextureUnit)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glActiveTexture(GL_TEXTURE0)
+        glUniform1i(self.layer_tex_id, NoteRender.LayerTextureUnit)
+        glUniform2i(self.layer_origin_id, viewport[0], viewport[1])
+
+
+    def _begin_layer(self, viewport: list) -> tuple:
+        """Start max blending into a copy of the staff layer, returning the state to restore when it is drawn."""
+        size = (viewport[2], viewport[3])
+        if size != self.layer_size:
+            self.layer_texture, self.layer_framebuffer = NoteRender._create_target(self.layer_texture, self.layer_framebuffer, *size)
+            self.layer_size = size
+        glCopyImageSubData(self.static_texture, GL_TEXTURE_2D, 0, 0, 0, 0, self.layer_texture, GL_TEXTURE_2D, 0, 0, 0, 0, size[0], size[1], 1)
+
+        state = (glGetIntegerv(GL_FRAMEBUFFER_BINDING), glIsEnabled(GL_BLEND), int(glGetIntegerv(GL_BLEND_EQUATION_RGB)))
+        glBindFramebuffer(GL_FRAMEBUFFER, self.layer_framebuffer)
+        glViewport(0, 0, size[0], size[1])
+        glEnable(GL_BLEND)
+        glBlendEquation(GL_MAX)
+        return state
+
+
+    def _end_layer(self, viewport: list, state: tuple):
+        """Restore the state from before the layer was started then draw the layer to the viewport."""
+        previous_framebuffer, blend, blend_equation = state
+        glBlendEquation(blend_equation)
+        if not blend:
+            glDisable(GL_BLEND)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_framebuffer)
+        glViewport(*viewport)
+
+        def layer_uniforms():
+            glUniform1i(self.pass_id, NoteRender.PassLayer)
+            self._bind_layer(self.layer_texture, viewport)
+
+        self.sprite.draw(layer_uniforms)
+
+
+    def _draw_static(self, viewport: list):
+        """Draw the staff and key signature into their texture when the key, staff geometry or viewport size changed."""
+        size = (viewport[2], viewport[3])
+        key_positions = self.staff.key_signature.positions
+        if size == self.static_size and key_positions is self.static_key_positions:
+            return
+
+        if size != self.static_size:
+            self.static_texture, self.static_framebuffer = NoteRender._create_target(self.static_texture, self.static_framebuffer, *size)
+            self.static_size = size
+        self.static_key_positions = key_positions
+        previous_framebuffer = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.static_framebuffer)
+
+        # Layer colours are written unblended so compositing reproduces drawing them with the notes
+        blend = glIsEnabled(GL_BLEND)
+        glDisable(GL_BLEND)
+        glViewport(0, 0, size[0], size[1])
+        glClearBufferfv(GL_COLOR, 0, (0.0, 0.0, 0.0, 0.0))
+
+        def static_uniforms():
+            glUniform1i(self.pass_id, NoteRender.PassStatic)
+            glUniform1f(self.display_ratio_id, self.display_ratio)
+            glUniform2f(self.viewport_size_id, size[0], size[1])
+            self._upload_changes()
+
+        self.sprite.draw(static_uniforms)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_framebuffer)
+        glViewport(*viewport)
+        if blend:
+            glEnable(GL_BLEND)
+
+
+    def _get_scissor(self, viewport: list, visible: np.ndarray) -> list:
+        """Return the rectangle of the viewport in pixels that notation can be drawn in: the staff, every visible
+        note with its ledger lines, stalks and ties, and the note name row at the top of the window when shown."""
+        # Notes are centred on the staff position, half the playable octaves either side
+        note_range = Staff.OctaveSpacing * Staff.NumNotes / 24 + Staff.StaffSpacing * NoteRender.LedgerHeadroom
+        left = Staff.Pos[0] - NoteRender.BinMargin * 2.0 - self.note_width
+        right = Staff.Pos[0] + Staff.Width
+        bottom = Staff.Pos[1] - note_range
+        top = 1.0 if self.songbook.show_note_names else Staff.Pos[1] + note_range
+
+        # Beams and ties can reach further, twice their texture space reach in NDC
+        if len(visible) > 0:
+            reach_left, _ = self._get_reach(visible, self.note_width * 0.5)
+            reach_y = self._get_stalk_reach(visible, self.note_width * 0.5)
+            left = min(left, float((self.note_positions[visible, 0] + reach_left * 2.0).min()))
+            bottom = min(bottom, float((self.note_positions[visible, 1] - reach_y * 2.0).min()))
+            top = max(top, float((self.note_positions[visible, 1] + reach_y * 2.0).max()))
+
+        view_x, view_y, view_width, view_height = viewport
+        def to_pixels(ndc: float, size: int, round_up: bool) -> int:
+            pixels = (ndc + 1.0) * 0.5 * size
+            return min(max(math.ceil(pixels) if round_up else math.floor(pixels), 0), size)
+
+        x0, x1 = to_pixels(left, view_width, False), to_pixels(right, view_width, True)
+        y0, y1 = to_pixels(bottom, view_height, False), to_pixels(top, view_height, True)
+        return [view_x + x0, view_y + y0, x1 - x0, y1 - y0]
 
 
     def draw(self, dt: float, music_time: float, note_width: float, notes_on: dict) -> dict:
-        """Process note timing then upload the note data state to the shader every frame."""
-        
+        """Process the timing of every slot at once then upload the note state that changed to the shader.
+        Notes reaching the playhead are added to notes_on once, on the frame they are first played."""
         self.note_width = note_width
 
         if not self.calibration:
-            for i in range(NoteRender.NumNotes):
-                note = self.notes[i]
-                npos = i * 2
-                cpos = i * 4
-                should_be_displayed = note is not None and note.time - music_time < 32 * 8
-                if should_be_displayed:
-                    self.note_colours[cpos + 3] = 1.0
-                    self.note_positions[npos] = self.ref_c4_pos[0] + ((note.time - music_time) * note_width)
-
-                    # Hold the visuals a 32nd note longer so the player can see which note to play
-                    should_be_played = note.time <= music_time and not note.is_rest()
-                    should_be_recycled = note.time + 1 < music_time
-                    if should_be_played:
-                        self.note_colours[cpos + 1] = NoteRender.HitColour[1]
-                    else:
-                        self.note_colours[cpos + 1] = NoteRender.BaseColour
-
-                    # Note is on as soon as it hits the playhead 
-                    if should_be_played:
-                        note_off_time = music_time + note.length
-                        if note.note in notes_on:
-                            # Dictionary entry will be a list if there are repeated notes
-                            if isinstance(notes_on[note.note], list):
-                                notes_on[note.note].append(note_off_time)
-                            else:
-                                notes_on[note.note] = [notes_on[note.note], note_off_time]
+            time_to_note = self.slot_time - music_time
+            reached = time_to_note <= 0
+
+            # Hold the visuals a 32nd note longer so the player can see which note to play
+            recycled = self.slot_active & (time_to_note < -1)
+
+            # Slots that are not displayed have no alpha so their positions do not matter
+            self.note_positions[:, 0] = self.ref_c4_pos[0] + time_to_note * note_width
+            self.note_colours[:, 1] = np.where(reached & self.slot_sounding, NoteRender.HitColour[1], NoteRender.BaseColour)
+            self.note_colours[:, 3] = self.slot_active & (time_to_note < NoteRender.MaxDisplayTime) & ~recycled
+
+            # Note is on as soon as it hits the playhead
+            played = reached & self.slot_waiting
+            if played.any():
+                self.slot_waiting &= ~played
+                for i in np.flatnonzero(played):
+                    note = int(self.slot_pitch[i])
+                    note_off_time = music_time + float(self.slot_length[i])
+                    if note in notes_on:
+                        # Dictionary entry will be a list if there are repeated notes
+                        if isinstance(notes_on[note], list):
+                            notes_on[note].append(note_off_time)
                         else:
-                            notes_on[note.note] = note_off_time
+                            notes_on[note] = [notes_on[note], note_off_time]
+                    else:
+                        notes_on[note] = note_off_time
+
+            if recycled.any():
+                recycled_slots = np.flatnonzero(recycled).tolist()
+                for i in recycled_slots:
+                    self.notes[i] = None
+                self.free_slots.extend(recycled_slots)
+                self.slot_active &= ~recycled
+                self.slot_sounding &= ~recycled
 
-                    if should_be_recycled:
-                        self.note_positions[npos] = -99.0
-                        self.note_colours[cpos + 3] = 0.0
-                        self.notes[i] = None
-                        self.notes_assigned -= 1
-                else:
-                    self.note_colours[cpos + 3] = 0.0
+        self._select_shader()
+        self._draw_notation(music_time)
+        return notes_on
+
+
+    def _draw_notation(self, music_time: float):
+        """Draw the staff and all visible notes with the notes shader over the whole window."""
+        visible = np.flatnonzero(self.note_colours[:, 3] > 0.0)
+        bins = self._get_bins(self.note_width, visible)
+        viewport = [int(v) for v in glGetIntegerv(GL_VIEWPORT)]
+        self._draw_static(viewport)
 
         def note_uniforms():
+            glUniform1i(self.pass_id, NoteRender.PassNotes)
+            self._bind_layer(self.static_texture, viewport)
             glUniform1f(self.display_ratio_id, self.display_ratio)
+            glUniform2f(self.viewport_size_id, viewport[2], viewport[3])
             glUniform1f(self.music_time_id, music_time)
-            glUniform1i(self.note_names_id, 1 if self.songbook.show_note_names else 0)
-            glUniform2fv(self.key_positions_id, KeySignature.NumAccidentals, self.staff.key_signature.positions)
-            glUniform2fv(self.note_positions_id, NoteRender.NumNotes, self.note_positions)
-            glUniform4fv(self.note_colours_id, NoteRender.NumNotes, self.note_colours)
-            glUniform1iv(self.note_types_id, NoteRender.NumNotes, self.note_types)
-            glUniform1iv(self.note_decoration_id, NoteRender.NumNotes, self.note_decoration)
-            glUniform2fv(self.note_hats_id, NoteRender.NumNotes, self.note_hats)
-            glUniform1fv(self.note_ties_id, NoteRender.NumNotes, self.note_ties)
-            glUniform2fv(self.note_extra_id, NoteRender.NumNotes, self.note_extra)
-        
-        self.sprite.draw(note_uniforms)
+            glUniform1f(self.note_width_id, self.note_width * 0.5)
+            self._upload_changes()
+            self._upload_bins(bins)
 
-        return notes_on
+        # The notation shader only runs on the part of the window that can hold notation
+        if self.calibration:
+            self.sprite.draw(note_uniforms)
+        else:
+            glEnable(GL_SCISSOR_TEST)
+            glScissor(*self._get_scissor(viewport, visible))
+            self.sprite.draw(note_uniforms)
+            glDisable(GL_SCISSOR_TEST)
 
     def end(self):
         pass
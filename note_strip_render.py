@@ -0,0 +1,221 @@
+import math
+import numpy as np
+from OpenGL.GL import (
+    glUniform1i,
+    glUniform1f,
+    glUniform2f,
+    glGetIntegerv, glIsEnabled, glEnable, glDisable, glViewport, glScissor,
+    glBindFramebuffer, glClearBufferfv,
+    GL_VIEWPORT, GL_FRAMEBUFFER, GL_FRAMEBUFFER_BINDING, GL_BLEND, GL_SCISSOR_TEST, GL_COLOR, GL_RGBA8,
+)
+
+from gamejam.graphics import Graphics
+
+from staff import Staff
+from note_render import NoteRender
+from song_book import SongBook
+
+
+class NoteStripRender(NoteRender):
+    """Draw notation from a ring of bars, each drawn once into a strip texture as it scrolls into view.
+    Notes never change shape after layout so a bar is only drawn again when a note reaching it is shown or
+    hidden, or the note width, window size or note names change. Each frame the bars are copied to the window
+    at their scrolled offset, snapped to whole pixels, and the few notes lit at the playhead are drawn over
+    them in the hit colour."""
+    MaxStripWidth = 8192 # Texels, the notes are drawn every frame when the ring would not fit at the current note width
+    BarPadding = 2 # Texels either side of each bar in the strip so snapped copies never read a neighbouring bar
+
+    def __init__(self, graphics: Graphics, staff: Staff, songbook: SongBook):
+        self.strip_texture = None
+        self.strip_framebuffer = None
+        self.strip_size = None
+        self.strip_settings = None
+        self.strip_bars = [] # The bar drawn in each part of the strip, None when it must be drawn again
+        self.bar_offset = 0 # Bars the music has been moved back by, added to each bar so the drawn bars keep their place
+        self.bar_width = 0
+        self.strip_displayed = np.zeros(0, dtype=bool)
+        super().__init__(graphics, staff, songbook)
+
+
+    def reset(self):
+        super().reset()
+        self.strip_bars = [None] * len(self.strip_bars)
+        self.bar_offset = 0
+        self.strip_displayed = np.zeros(self.num_notes, dtype=bool)
+
+
+    def _prepare_strip(self, viewport: list, width_32nd: float) -> bool:
+        """Size the ring for the note width and viewport, forgetting every bar when either changes.
+        Return False when the bars on screen would not fit in the strip."""
+        if width_32nd <= 0.0:
+            return False
+
+        view_width, view_height = viewport[2], viewport[3]
+        bar_width = math.ceil(width_32nd * view_width * 32) + NoteStripRender.BarPadding * 2
+        num_bars = math.ceil(1.0 / width_32nd / 32) + 2
+        if bar_width * num_bars > NoteStripRender.MaxStripWidth:
+            return False
+
+        settings = (self.note_width, view_width, view_height, self.songbook.show_note_names)
+        if settings != self.strip_settings:
+            self.strip_settings = settings
+            self.bar_width = bar_width
+            size = (bar_width * num_bars, view_height)
+            if size != self.strip_size:
+                self.strip_texture, self.strip_framebuffer = NoteRender._create_target(self.strip_texture, self.strip_framebuffer, *size, GL_RGBA8)
+                self.strip_size = size
+            self.strip_bars = [None] * num_bars
+        return True
+
+
+    def rebase(self, time: float):
+        """Move every assigned note back in time by whole bars, keeping the bars already drawn."""
+        super().rebase(time)
+        self.bar_offset += int(time // 32)
+
+
+    def _update_displayed(self, width_32nd: float):
+        """Forget the bars reached by any note that has been shown or hidden since the last frame."""
+        displayed = self.note_colours[:, 3] > 0.0
+        if len(self.strip_displayed) != len(displayed):
+            self.strip_displayed = np.concatenate((self.strip_displayed, np.zeros(len(displayed) - len(self.strip_displayed), dtype=bool)))
+        changed = np.flatnonzero(displayed != self.strip_displayed)
+        self.strip_displayed = displayed
+        if len(changed) == 0:
+            return
+
+        reach_left, reach_right = self._get_reach(changed, width_32nd)
+        first_bars = np.floor((self.slot_time[changed] + reach_left / width_32nd) / 32).astype(np.int64) + self.bar_offset
+        last_bars = np.floor((self.slot_time[changed] + reach_right / width_32nd) / 32).astype(np.int64) + self.bar_offset
+        num_bars = len(self.strip_bars)
+        for first, last in zip(first_bars.tolist(), last_bars.tolist()):
+            for bar in range(first, min(last, first + num_bars - 1) + 1):
+                if self.strip_bars[bar % num_bars] == bar:
+                    self.strip_bars[bar % num_bars] = None
+
+
+    def _draw_bar(self, bar: int, viewport: list, width_32nd: float):
+        """Draw every displayed note reaching a bar into its part of the strip in the base colour.
+        The notes are placed as they would be on screen when the bar starts at the left edge of the window."""
+        num_bars = len(self.strip_bars)
+        strip_bar = bar + self.bar_offset
+        strip_start = (strip_bar % num_bars) * self.bar_width
+        playhead = (self.ref_c4_pos[0] + 1.0) * 0.5
+        bar_time = bar * 32 + playhead / width_32nd
+        self.note_positions[:, 0] = self.ref_c4_pos[0] + (self.slot_time - bar_time) * self.note_width
+        self.note_colours[:, :3] = NoteRender.BaseColour
+        self.note_colours[:, 3] = self.strip_displayed
+        bins = self._get_bins(self.note_width)
+
+        previous_framebuffer = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        blend = glIsEnabled(GL_BLEND)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.strip_framebuffer)
+        glViewport(strip_start + NoteStripRender.BarPadding, 0, viewport[2], viewport[3])
+        glEnable(GL_SCISSOR_TEST)
+        glScissor(strip_start, 0, self.bar_width, viewport[3])
+        glDisable(GL_BLEND)
+        glClearBufferfv(GL_COLOR, 0, (0.0, 0.0, 0.0, 0.0))
+
+        def bar_uniforms():
+            glUniform1i(self.pass_id, NoteRender.PassNotesOnly)
+            glUniform1f(self.display_ratio_id, self.display_ratio)
+            glUniform2f(self.viewport_size_id, viewport[2], viewport[3])
+            glUniform1f(self.note_width_id, width_32nd)
+            self._upload_changes()
+            self._upload_bins(bins)
+
+        self.sprite.draw(bar_uniforms)
+        glDisable(GL_SCISSOR_TEST)
+        if blend:
+            glEnable(GL_BLEND)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_framebuffer)
+        glViewport(*viewport)
+        self.strip_bars[strip_bar % num_bars] = strip_bar
+
+
+    def _draw_bars(self, bars: range, music_time: float, viewport: list, width_32nd: float):
+        """Copy each bar on screen from the strip to its scrolled position in the layer."""
+        num_bars = len(self.strip_bars)
+        view_width, view_height = viewport[2], viewport[3]
+        playhead = (self.ref_c4_pos[0] + 1.0) * 0.5
+
+        def get_bar_pixel(bar: int) -> float:
+            return (playhead + (bar * 32 - music_time) * width_32nd) * view_width
+
+        glEnable(GL_SCISSOR_TEST)
+        for bar in bars:
+            start = round(get_bar_pixel(bar))
+            end = round(get_bar_pixel(bar + 1))
+            if end <= 0 or start >= view_width:
+                continue
+
+            # Layer texels are read at the window pixel less the origin, which moves the bar to its pixel
+            strip_start = ((bar + self.bar_offset) % num_bars) * self.bar_width + NoteStripRender.BarPadding
+            origin = [round(get_bar_pixel(bar) - strip_start), 0]
+
+            def bar_uniforms():
+                glUniform1i(self.pass_id, NoteRender.PassLayer)
+                self._bind_layer(self.strip_texture, origin)
+
+            glScissor(max(start, 0), 0, min(end, view_width) - max(start, 0), view_height)
+            self.sprite.draw(bar_uniforms)
+        glDisable(GL_SCISSOR_TEST)
+
+
+    def _draw_hit_notes(self, viewport: list, width_32nd: float):
+        """Draw the notes lit at the playhead over the bars in the layer, only across the part of the window they reach."""
+        hit = np.flatnonzero((self.note_colours[:, 1] > NoteRender.BaseColour) & (self.note_colours[:, 3] > 0.0))
+        if len(hit) == 0:
+            return
+
+        bins = self._get_bins(self.note_width, hit)
+        pos_x = (self.note_positions[hit, 0] + 1.0) * 0.5
+        reach_left, reach_right = self._get_reach(hit, width_32nd)
+        start = max(math.floor(float(np.min(pos_x + reach_left)) * viewport[2]), 0)
+        end = min(math.ceil(float(np.max(pos_x + reach_right)) * viewport[2]), viewport[2])
+        if end <= start:
+            return
+
+        def hit_uniforms():
+            glUniform1i(self.pass_id, NoteRender.PassNotesOnly)
+            glUniform1f(self.display_ratio_id, self.display_ratio)
+            glUniform2f(self.viewport_size_id, viewport[2], viewport[3])
+            glUniform1f(self.note_width_id, width_32nd)
+            self._upload_changes()
+            self._upload_bins(bins)
+
+        glEnable(GL_SCISSOR_TEST)
+        glScissor(start, 0, end - start, viewport[3])
+        self.sprite.draw(hit_uniforms)
+        glDisable(GL_SCISSOR_TEST)
+
+
+    def _draw_notation(self, music_time: float):
+        """Draw any bars that scrolled into view or changed, then copy the bars and hit notes over the staff."""
+        viewport = [int(v) for v in glGetIntegerv(GL_VIEWPORT)]
+        width_32nd = self.note_width * 0.5
+        if self.calibration or not self._prepare_strip(viewport, width_32nd):
+            super()._draw_notation(music_time)
+            return
+
+        self._draw_static(viewport)
+        self._update_displayed(width_32nd)
+
+        playhead = (self.ref_c4_pos[0] + 1.0) * 0.5
+        first_bar = math.floor((music_time - playhead / width_32nd) / 32)
+        last_bar = math.floor((music_time + (1.0 - playhead) / width_32nd) / 32)
+        bars = range(first_bar, last_bar + 1)
+
+        # Bars are drawn with their own note positions and colours, the frame's are put back for the hit notes
+        num_bars = len(self.strip_bars)
+        missing_bars = [bar for bar in bars if self.strip_bars[(bar + self.bar_offset) % num_bars] != bar + self.bar_offset]
+        if len(missing_bars) > 0:
+            frame_fields = self.frame_fields.copy()
+            for bar in missing_bars:
+                self._draw_bar(bar, viewport, width_32nd)
+            self.frame_fields[:] = frame_fields
+
+        layer_state = self._begin_layer(viewport)
+        self._draw_bars(bars, music_time, viewport, width_32nd)
+        self._draw_hit_notes(viewport, width_32nd)
+        self._end_layer(viewport, layer_state)
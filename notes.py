@@ -1,12 +1,17 @@
-from copy import deepcopy
+import bisect
+from collections import deque
+from itertools import takewhile
+
 from gamejam.coord import Coord2d
 from gamejam.texture import SpriteShape
 from gamejam.graphics import Graphics
 from gamejam.settings import GameSettings
 
 from staff import Staff
-from note import Note, NoteDecoration
+from note import Note, DecoratedNote
+from key_signature import KeySignature, BarAccidentals
 from note_render import NoteRender
+from layout_cache import LayoutCache
 
 
 class Notes:
@@ -15,6 +20,10 @@ class Notes:
     for each piece of music, then notes manages when they should be on-screen.
     """
     BarlineWidth = 0.005
+    LayoutAheadBars = 4
+    FeedAhead32nds = 8 # Notes are assigned to the render this long before they come into view
+    LayoutVersion = 4 # Increment when layout changes to ignore cached layouts
+    SeekHeldBars = 4 # How far back to look for notes still sounding after a seek
 
     @staticmethod
     def note_number_to_name(note_num: int) -> str:
@@ -27,14 +36,21 @@ class Notes:
     def __init__(self, graphics:Graphics, note_render: NoteRender, staff: Staff, note_positions: list):
         self.graphics = graphics
         self.note_render = note_render
-        self.notes = []
+        self.source_notes = []
+        self.layout_key = ""
+        self.layout_cache = LayoutCache()
+        self.recording = None
+        self.notes = deque()
+        self.layout = None
+        self.loop_notes = None
         self.num_barlines = 8
         self.barlines = []
         self.bartimes = []
-        self.notes = []
         self.note_positions = note_positions
         self.staff = staff
         self.ref_c4_pos = [Staff.Pos[0], note_positions[60]]
+        self.draw_time = 0.0
+        self.feed_ahead = self._get_feed_ahead(Staff.NoteWidth32nd)
 
         # Create the barlines with 0 being the immovable 0 bar
         staff_width = Staff.StaffSpacing * 4.0
@@ -47,137 +63,223 @@ class Notes:
 
 
     def reset(self):
-        self.notes = []
+        self.source_notes = []
+        self.layout_key = ""
+        self.loop_notes = None
         self.rewind()
 
 
     def rewind(self):
         """Restore the note pool and barlines to their original state without clearing the music."""
-        self.notes_offset = 0
         self.notes_on = {}
         self.note_render.reset()
+        self.notes = deque()
+        self.layout = self._get_layout(0)
+        self.layout_time = 0
 
         for i in range(self.num_barlines):
             self.bartimes[i] = i * 32.0
 
-        self.add_notes_to_render()
+        self.draw_time = 0.0
+        self.layout_ahead(0.0)
+        self.add_notes_to_render(0.0)
+
+
+    def assign_notes(self, notes: list, content_hash: str = "", track_id: int = 0, semitones: int = 0):
+        """Start laying out a piece of music, only the first few bars are laid out before returning.
+        Music with a content hash reuses the layout from a previous play or transposition when it is cached."""
+        self.source_notes = notes
+        self.layout_key = LayoutCache.get_key(content_hash, track_id, self.staff.key_signature.key, Notes.LayoutVersion, semitones) if content_hash else ""
+        self.rewind()
 
 
-    def assign_notes(self, notes: list):
-        """Walk in sequence through the notes setting the decoration values for drawing."""
-        self.notes = deepcopy(notes)
-        note_id = 0
-        time = 0
-        bar_time_max = 32 # TODO Derive number of 32s in a bar from time signature
-        bar_time = bar_time_max
-        num_notes = len(self.notes)
+    def prepare_layout(self, notes: list, content_hash: str, track_id: int, key: str, semitones: int = 0):
+        """Lay out all of a piece of music into the layout cache so it is ready when the music is assigned.
+        This can run on a worker thread as the layout uses its own key signature rather than the staff's."""
+        layout_key = LayoutCache.get_key(content_hash, track_id, key, Notes.LayoutVersion, semitones)
+        if self.layout_cache.get(layout_key) is not None:
+            return
+        key_signature = KeySignature()
+        key_signature.set(key)
+        self.layout_cache.put(layout_key, [note.to_record() for note in self._layout(notes, 0, key_signature)])
+
+
+    def seek(self, music_time: float):
+        """Lay out the notes from the start of the bar at any music time, skipping notes already
+        played and restoring the notes held over the playhead, without laying out the music before it."""
+        bar_time = int(music_time // 32) * 32
+        self.notes_on = self._get_held_notes(music_time)
+        self.note_render.reset()
+        self.notes = deque()
+        self.layout = self._get_layout(bar_time)
+        self.layout_time = bar_time
+
+        # Barlines are on every bar so can be placed directly
+        for i in range(self.num_barlines):
+            self.bartimes[i] = bar_time + i * 32.0
+
+        self.layout_ahead(music_time)
+        while (len(self.notes) > 0 or self._layout_next()) and self.notes[0].time + 1 < music_time:
+            self.notes.popleft()
+        self.draw_time = music_time
+        self.add_notes_to_render(music_time)
+
+
+    def set_loop(self, start_time: int, end_time: int):
+        """Lay out the notes between two bar times once, then lay out the music again from the playhead
+        so the notes after the end of the loop are replaced by the start of its next pass."""
+        layout = self._layout_cached(self.source_notes, self.layout_key, start_time)
+        self.loop_notes = [n.to_record() for n in takewhile(lambda n: n.time < end_time, layout) if n.time >= start_time]
+        self.loop_held = self._get_held_notes(start_time)
+        self.loop_time = start_time
+        self.loop_end = end_time
+        self.seek(self.draw_time)
+
+
+    def loop_restart(self):
+        """Return to the start of the loop set by set_loop. The next pass is already assigned a loop length
+        after the first, so only the times of the notes and barlines are moved back by the loop length."""
+        loop_length = self.loop_end - self.loop_time
+        self.notes_on = dict(self.loop_held)
+        self.note_render.rebase(loop_length)
+        for note in self.notes:
+            note.time -= loop_length
+        self.loop_offset -= loop_length
+        self.layout_time -= loop_length
+
+        for i in range(self.num_barlines):
+            self.bartimes[i] -= loop_length
+
+        self.draw_time -= loop_length
+
+
+    def clear_loop(self, music_time: float):
+        """Forget the loop set by set_loop. Passes of the loop are laid out ahead of its end,
+        so the music is laid out again from the playhead."""
+        if self.loop_notes is not None:
+            self.loop_notes = None
+            self.seek(music_time)
+
+
+    def _get_held_notes(self, music_time: float) -> dict:
+        """Return the off times of notes that started before the playhead and are still sounding."""
+        notes = self.source_notes
+        start_id = bisect.bisect_left(notes, music_time - Notes.SeekHeldBars * 32, key=lambda n: n.time)
+        end_id = bisect.bisect_left(notes, music_time - 1, key=lambda n: n.time)
+        notes_on = {}
+        for note_id in range(start_id, end_id):
+            note = notes[note_id]
+            if note.time + note.length > music_time and note.note in self.note_positions:
+                notes_on[note.note] = note.time + note.length
+        return notes_on
+
+
+    def _get_layout(self, start_time: int):
+        """Lay out the music from a bar time, repeating the notes of the loop after its end when one is set."""
+        layout = self._layout_cached(self.source_notes, self.layout_key, start_time)
+        if self.loop_notes is None:
+            return layout
+        self.loop_offset = self.loop_end - self.loop_time
+        return self._layout_loop(layout)
+
+
+    def _layout_loop(self, layout):
+        """Lay out the music up to the end of the loop then the notes of the loop pass after pass,
+        each a loop offset later so the next pass is assigned before the playhead wraps."""
+        yield from takewhile(lambda n: n.time < self.loop_end, layout)
+        while len(self.loop_notes) > 0:
+            for record in self.loop_notes:
+                yield DecoratedNote.from_record(record[:1] + (record[1] + self.loop_offset,) + record[2:])
+            self.loop_offset += self.loop_end - self.loop_time
+
+
+    def _layout_cached(self, notes: list, key: str, start_time: int = 0):
+        """Replay a cached layout, otherwise lay out the notes while recording them for the cache.
+        A recording interrupted by a rewind is replayed up to where it stopped then continues."""
+        records = self.layout_cache.get(key) if key else None
+        if records is not None:
+            start_id = bisect.bisect_left(records, start_time, key=lambda r: r[1]) if start_time > 0 else 0
+            for record_id in range(start_id, len(records)):
+                yield DecoratedNote.from_record(records[record_id])
+            return
+
+        # Layouts starting part way through the music are not recorded
+        if not key or start_time > 0:
+            yield from self._layout(notes, start_time)
+            return
+
+        if self.recording is None or self.recording[0] != key:
+            self.recording = (key, [], self._layout(notes))
+        _, records, layout = self.recording
+        for record_id in range(len(records)):
+            yield DecoratedNote.from_record(records[record_id])
+
+        for note in layout:
+            if records is not None:
+                records.append(note.to_record())
+                if len(records) > LayoutCache.MaxMemoryNotes:
+                    self.recording = None
+                    records = None
+            yield note
+
+        if records is not None:
+            self.layout_cache.put(key, records)
+            self.recording = None
+
+
+    def _layout(self, notes: list, start_time: int = 0, key_signature: KeySignature = None):
+        """Walk once through the notes yielding rests and decorated copies of each note for drawing.
+        Notes in an unfinished hat chain are held back until the chain is complete."""
+        time = start_time
+        bar_time_max = Note.BarLength
+        last_note_id = len(notes) - 1
         hats = []
         hat_max = 4
-        prev_note = None
-        prev_note_lookup = None
+        pending = deque()
+        note_positions = self.note_positions
+        rest_pos_y = note_positions[64]
+        accidentals = BarAccidentals(key_signature or self.staff.key_signature, note_positions)
 
-        def get_note_pos(time, pitch):
-            return [time, self.note_positions[pitch]]
+        def add_rest(time, rest_length):
+            rest = DecoratedNote(0, time + (rest_length // 2), rest_length)
+            rest.decorate_rest([time + (rest_length // 2), rest_pos_y], Note.RestTypes[rest_length])
+            pending.append(rest)
 
-        while note_id < num_notes:
-            note = self.notes[note_id]
+        start_id = bisect.bisect_left(notes, start_time, key=lambda n: n.time) if start_time > 0 else 0
+        for note_id in range(start_id, len(notes)):
+            source_note = notes[note_id]
 
             # Don't add notes that cannot be played
-            if note.note not in self.note_positions:
+            if source_note.note not in note_positions:
                 if GameSettings.DEV_MODE:
-                    print(f"Ignoring a note that is out of playable range: {note.note}") 
-                self.notes.remove(note)
-                num_notes -= 1
+                    print(f"Ignoring a note that is out of playable range: {source_note.note}")
                 continue
-            
-            time_to_next = note.time - time
 
-            # Handle rests greater than a bar
-            if time_to_next >= bar_time_max:
-                rest = Note(0, time + (bar_time_max // 2), bar_time_max)
-                rest.decorate_rest(get_note_pos(time + (bar_time_max // 2), 64), Note.get_rest_type(bar_time_max))
-                self.notes.insert(note_id, rest)
+            note = DecoratedNote(source_note.note, source_note.time, source_note.length)
+
+            # Handle rests greater than a bar, then insert rests before the next note
+            time_to_next = note.time - time
+            while time_to_next >= bar_time_max:
+                add_rest(time, bar_time_max)
                 time += bar_time_max
-                note_id += 1
-                num_notes += 1
-                continue
+                time_to_next -= bar_time_max
 
-            # Insert rests before the next note
-            num_inserted_rests = 0
             while time_to_next > 0:
-                rest_length = Note.get_quanitized_rest(time_to_next)
-                rest = Note(0, time + (rest_length // 2), rest_length)
-                rest.decorate_rest(get_note_pos(time + (rest_length // 2), 64), Note.get_rest_type(rest_length))
-                self.notes.insert(note_id + num_inserted_rests, rest)
+                rest_length = Note.QuantizedRests[time_to_next]
+                add_rest(time, rest_length)
                 time_to_next -= rest_length
                 time += rest_length
-                bar_time -= rest_length
-                num_inserted_rests += 1
 
-            # Advance to the next real note
-            if num_inserted_rests > 0:
-                note_id += num_inserted_rests
-                num_notes += num_inserted_rests
-                continue
-
-            # Handle accidentals, sharp going up, flat coming down
-            prev_note_lookup = prev_note.note % 12 if prev_note is not None else note.note % 12
-            note.note_drawn, accidental = self.staff.key_signature.get_accidental(note.note, prev_note_lookup, [])
-            quantized_length, dotted = Note.get_quantized_length(note.length)
+            # Handle accidentals, spelled as the key or sharp going up and flat coming down, each lasting until the end of the bar
+            note.note_drawn, accidental = accidentals.get(note.note, note.time)
+            quantized_length, dotted = Note.QuantizedLengths[max(0, min(note.length, 48))]
 
             # Set timing type and dotted
-            type = Note.get_note_type(quantized_length)
-            decoration = NoteDecoration.DOTTED if dotted else NoteDecoration.NONE
-            if accidental is not None:
-                decoration = int(decoration.value) + 2 + accidental
-                decoration = NoteDecoration(decoration)
+            type = Note.NoteTypes[quantized_length]
+            decoration = Note.Decorations[(dotted, accidental)]
 
             # Add hats only when we get to the end of the hat chain
             hat_num = len(hats)
-            def add_all_hats(hats, note_positions):
-                # True is stem pointing up
-                num_hats = len(hats)
-                hat_dir = hats[0].note_drawn < 72 and hats[num_hats -1].note_drawn < 72
-                hat_tallest_note = 0 if hat_dir else 999
-                straight_hat = True # TODO Handle hats slanting up and down
-
-                # Find the tallest note stem (lowest note)
-                hcount = 0
-                for h in hats:
-                    if hcount < num_hats - 1:
-                        if hat_dir:
-                            if h.note_drawn > hat_tallest_note:
-                                hat_tallest_note = h.note_drawn
-                        elif h.note_drawn < hat_tallest_note:
-                            hat_tallest_note = h.note_drawn
-                    hcount += 1
-
-                max_hat_diff = 0.125
-                if num_hats == 2:
-                    hat_note = hats[0]
-                    hat_note_next = hats[1]
-                    y_diff = note_positions[hat_note_next.note_drawn] - note_positions[hat_note.note_drawn]
-                    if abs(y_diff) >= max_hat_diff:
-                        capped_y = -max_hat_diff if y_diff < 0 else max_hat_diff
-                        hat_note.hat = [hat_note.length, capped_y * 0.5]
-                        hat_note_next.extra[1] = -(y_diff - max_hat_diff)
-                    else:
-                        hat_note.hat = [hat_note.length, y_diff * 0.5]
-                    hat_note_next.hat = [0.0, 0.0]
-                elif straight_hat:
-                    for count in range(num_hats):
-                        hat_note = hats[count]
-                        hat_note.hat = [hat_note.length, 0.0]
-                        y_diff = 0
-                        if hat_dir and hat_tallest_note in note_positions:
-                            y_diff = note_positions[hat_tallest_note] - note_positions[hat_note.note_drawn]
-                        elif hat_tallest_note in note_positions:
-                            y_diff = note_positions[hat_note.note_drawn] - note_positions[hat_tallest_note]
-                        hat_note.extra = [0.0, y_diff]
-
-                # Remove the tail from the last note in the chain
-                hats[num_hats - 1].hat = [0.0, -1.0]
-
             if note.length <= 8:
                 if hat_num < hat_max:
                     if hat_num <= 1:
@@ -188,43 +290,117 @@ class Notes:
                         if same_length and no_rest_between and not note.is_rest():
                             hats.append(note)
                         else:
-                            add_all_hats(hats, self.note_positions)
+                            self._add_all_hats(hats)
                             hats = []
                             hats.append(note)
-                
+
                 # 4 notes max in one hat chain
-                if len(hats) >= hat_max or note_id == num_notes - 1:
-                    add_all_hats(hats, self.note_positions)
+                if len(hats) >= hat_max or note_id == last_note_id:
+                    self._add_all_hats(hats)
                     hats = []
-            elif hat_num > 1:
-                add_all_hats(hats, self.note_positions)
+            elif hat_num > 0:
+                # A lone short note keeps its tail rather than joining a note after a longer one
+                if hat_num > 1:
+                    self._add_all_hats(hats)
                 hats = []
-                            
-            note.decorate(get_note_pos(note.time, note.note_drawn), type, decoration, note.hat, note.tie, note.extra)
-
-            bar_time -= note.length
-            time += note.length
-            note_id += 1
-            prev_note = note
 
-        self.add_notes_to_render()
- 
+            note.decorate([note.time, note_positions[note.note_drawn]], type, decoration, note.hat, note.tie, note.extra)
+            pending.append(note)
 
-    def add_notes_to_render(self, num_notes:int=-1):
-        """Add a number of notes to the render queue, -1 meaning add the maximum."""
+            time += note.length
 
-        notes_len = len(self.notes)
-        num_notes = NoteRender.NumNotes // 2 if num_notes < 0 else num_notes
-        num_to_add = min(num_notes, notes_len - self.notes_offset)
-        for count in range(num_to_add):
-            index = self.notes_offset + count
-            note = self.notes[index]
+            while len(pending) > 0 and pending[0] not in hats:
+                yield pending.popleft()
+
+        yield from pending
+
+
+    def _add_all_hats(self, hats: list):
+        """Join the stalks of a chain of eighth notes or shorter, called at the end of each hat chain."""
+        note_positions = self.note_positions
+
+        # True is stem pointing up
+        num_hats = len(hats)
+        hat_dir = hats[0].note_drawn < 72 and hats[num_hats -1].note_drawn < 72
+        hat_tallest_note = 0 if hat_dir else 999
+        straight_hat = True # TODO Handle hats slanting up and down
+
+        # Find the tallest note stem (lowest note)
+        hcount = 0
+        for h in hats:
+            if hcount < num_hats - 1:
+                if hat_dir:
+                    if h.note_drawn > hat_tallest_note:
+                        hat_tallest_note = h.note_drawn
+                elif h.note_drawn < hat_tallest_note:
+                    hat_tallest_note = h.note_drawn
+            hcount += 1
+
+        max_hat_diff = 0.125
+        if num_hats == 2:
+            hat_note = hats[0]
+            hat_note_next = hats[1]
+            y_diff = note_positions[hat_note_next.note_drawn] - note_positions[hat_note.note_drawn]
+            if abs(y_diff) >= max_hat_diff:
+                capped_y = -max_hat_diff if y_diff < 0 else max_hat_diff
+                hat_note.hat = [hat_note.length, capped_y * 0.5]
+                hat_note_next.extra[1] = -(y_diff - max_hat_diff)
+            else:
+                hat_note.hat = [hat_note.length, y_diff * 0.5]
+            hat_note_next.hat = [0.0, 0.0]
+        elif straight_hat:
+            for count in range(num_hats):
+                hat_note = hats[count]
+                hat_note.hat = [hat_note.length, 0.0]
+                y_diff = 0
+                if hat_dir and hat_tallest_note in note_positions:
+                    y_diff = note_positions[hat_tallest_note] - note_positions[hat_note.note_drawn]
+                elif hat_tallest_note in note_positions:
+                    y_diff = note_positions[hat_note.note_drawn] - note_positions[hat_tallest_note]
+                hat_note.extra = [0.0, y_diff]
+
+        # Remove the tail from the last note in the chain
+        hats[num_hats - 1].hat = [0.0, -1.0]
+
+
+    def _layout_next(self) -> bool:
+        """Lay out the next note or rest in the music, returning False at the end."""
+        if self.layout is None:
+            return False
+        note = next(self.layout, None)
+        if note is None:
+            self.layout = None
+            return False
+        self.notes.append(note)
+        self.layout_time = note.time
+        return True
+
+
+    def layout_ahead(self, music_time: float):
+        """Keep the laid out notes a few bars ahead of the music time."""
+        horizon = music_time + Notes.LayoutAheadBars * 32
+        while self.layout_time < horizon and self._layout_next():
+            pass
+
+
+    def _get_feed_ahead(self, note_width: float, frame_advance: float = 0.0) -> float:
+        """Return how far ahead of the playhead in 32nds notes are assigned to the render so none appear late.
+        This is the part of the staff right of the playhead at the current note width, with a margin
+        and the music time of the last frame so fast tempos stay ahead."""
+        staff_end = Staff.Pos[0] + Staff.Width
+        visible = (staff_end - self.ref_c4_pos[0]) / note_width if note_width > 0 else NoteRender.MaxDisplayTime
+        return min(visible, NoteRender.MaxDisplayTime) + Notes.FeedAhead32nds + frame_advance
+
+
+    def add_notes_to_render(self, music_time: float):
+        """Assign every note starting before the feed horizon ahead of a music time to the render."""
+        feed_time = music_time + self.feed_ahead
+        while (len(self.notes) > 0 or self._layout_next()) and self.notes[0].time < feed_time:
+            note = self.notes.popleft()
             self.note_render.assign(note)
             if GameSettings.DEV_MODE and not note.is_decorated():
                 print(f"Error: Undecorated note added to note rendering!")
 
-        self.notes_offset += num_to_add
-
 
     def draw(self, dt: float, music_time: float, note_width: float) -> dict:
         """Draw and update the bar lines and all notes on the GPU.
@@ -246,9 +422,11 @@ class Notes:
         # Draw all the notes and return times for the ones that are playing
         self.note_render.draw(dt, music_time, note_width, self.notes_on)
 
-        # Start adding new notes when halfway through the display buffer
-        if len(self.notes) > 0 and self.notes_offset < len(self.notes):
-            if self.note_render.get_num_free_notes() >= NoteRender.NumNotes // 2 and self.notes[self.notes_offset].time < music_time * 8:
-                self.add_notes_to_render()
+        # Keep every note up to the display horizon assigned, laying out a few bars beyond it
+        frame_advance = min(max(music_time - self.draw_time, 0.0), 32.0)
+        self.draw_time = music_time
+        self.feed_ahead = self._get_feed_ahead(note_width, frame_advance)
+        self.layout_ahead(music_time + self.feed_ahead)
+        self.add_notes_to_render(music_time)
 
         return self.notes_on
@@ -1,14 +1,15 @@
 import os
 import math
+import hashlib
 from mido import (
     MidiFile,
     Message, MetaMessage,
     tempo2bpm
 )
+import numpy as np
 import numpy.random as rng
 from note import Note
 from key_signature import KeySignature
-from score import MAX_SCORE_PER_NOTE
 
 class Song:
     """A song is a combination of music notes and metadata that the game uses to
@@ -21,6 +22,8 @@ class Song:
     MinVelocity = 64 # 50% of max
     BackingChannel = 1
     BackingProgram = 0  # Acoustic Grand Piano
+    DrumChannel = 9 # Channel 10 in General MIDI
+    AutoTrack = -1 # Pick the player track from the track statistics
 
     def __init__(self):
         self.artist = "Unknown Artist"
@@ -36,12 +39,39 @@ class Song:
         self.track_names: dict[str] = {}
         self.backing_tracks: dict[list[Message]] = {}
         self.notes: list[Note] = []
+        self.midi_tracks: dict[int, list[Message]] = {}
+        self.track_stats: dict[int, dict] = {}
+        self.content_hash = ""
         self.saved = False
         self.dirty = False
 
+    def __getstate__(self):
+        # Raw midi tracks are read from the file again when needed rather than saved in the song book
+        state = self.__dict__.copy()
+        state.pop("midi_tracks", None)
+        return state
+
+    def __setstate__(self, dict_):
+        self.__dict__ = dict_
+        self.midi_tracks = {}
+        if not hasattr(self, "track_stats"): self.track_stats = {}
+        if not hasattr(self, "content_hash"): self.content_hash = ""
+
     def get_name(self):
         return f"{self.artist} - {self.title}"
 
+    def get_key(self) -> tuple[str, str]:
+        return (self.artist, self.title)
+
+    def update_content_hash(self):
+        """Hash the note data of every track so the same music is recognised whatever the file is called."""
+        content = hashlib.sha1()
+        tracks = [Song._get_track_notes(self.midi_tracks[id], self.ticks_per_beat) for id in sorted(self.midi_tracks)] if self.midi_tracks else [self.notes]
+        for notes in tracks:
+            content.update(np.array([(n.note, n.time, n.length) for n in notes], dtype=np.int64).tobytes())
+            content.update(b"|")
+        self.content_hash = content.hexdigest()
+
     def get_max_score(self):
         """Calculate maximum possible score for the song."""
         if not self.notes:
@@ -357,8 +387,9 @@ class Song:
         spacing = note_spacing_range[0] if note_spacing_range[0] == note_spacing_range[1] else rng.randint(note_spacing_range[0], note_spacing_range[1])
         self.add_random_notes(song_length_notes, key, tonic, note_range, note_length, spacing)
 
-    def from_midi_file(self, filepath: str, player_track_id: int = 0):
-        keys = {}
+    def from_midi_file(self, filepath: str, player_track_id: int = AutoTrack):
+        """Read a midi file, caching every track so the player track can be switched without reading the file again.
+        A player_track_id of AutoTrack picks the best melody track from the per-track statistics."""
         if not os.path.exists(filepath):
             return
 
@@ -384,11 +415,11 @@ class Song:
 
         mid = MidiFile(filepath)
         self.ticks_per_beat = mid.ticks_per_beat
-        self.player_track_id = player_track_id
-        absolute_time = 0
+        self.midi_tracks = {}
         for id, track in enumerate(mid.tracks):
             if track.name:
                 self.track_names[id] = track.name
+            messages = []
             for msg in track:
                 if isinstance(msg, MetaMessage):
                     if msg.type == "set_tempo":
@@ -401,35 +432,106 @@ class Song:
                         self.key_signature = msg.key
                     elif msg.type == "track_name":
                         self.track_names[id] = msg.name
-                if id == player_track_id:
-                    if isinstance(msg, Message):
-                        # note_on with velocity of 0 is interpreted as note_off
-                        if msg.type == "note_on" and msg.velocity >= Song.MinVelocity:
-                            absolute_time += msg.time
-                            keys[msg.note] = absolute_time
-                        elif msg.type == "note_off" or msg.type == "note_on" and msg.velocity <= 0:
-                            if msg.note in keys:
-                                note_length = absolute_time + msg.time - keys[msg.note]
-                                length_in_32s = math.ceil(note_length / self.ticks_per_beat * Song.SDQNotesPerBeat)
-                                time_in_32s = math.ceil(keys[msg.note] / self.ticks_per_beat * Song.SDQNotesPerBeat)
-                                if length_in_32s >= Song.MinNoteLength32s:
-                                    self.notes.append(Note(msg.note, time_in_32s, length_in_32s))
-                                    keys.pop(msg.note)
-                                absolute_time += msg.time
                 else:
-                    if not isinstance(msg, MetaMessage):
-                        if id in self.backing_tracks:
-                            self.backing_tracks[id].append(msg)
-                        else:
-                            self.backing_tracks[id] = []
-                            self.backing_tracks[id].append(msg)
+                    messages.append(msg)
+            self.midi_tracks[id] = messages
+
+        self.analyse_tracks()
+        self.update_content_hash()
+        self.player_track_id = self.get_best_track() if player_track_id < 0 else player_track_id
+        self._apply_player_track()
+
+    @staticmethod
+    def _get_track_notes(messages: list, ticks_per_beat: int) -> list[Note]:
+        """Convert the note on and off messages of one midi track to notes timed in 32nds, sorted by start time."""
+        notes = []
+        keys = {}
+        absolute_time = 0
+        for msg in messages:
+            # note_on with velocity of 0 is interpreted as note_off
+            if msg.type == "note_on" and msg.velocity >= Song.MinVelocity:
+                absolute_time += msg.time
+                keys[msg.note] = absolute_time
+            elif msg.type == "note_off" or msg.type == "note_on" and msg.velocity <= 0:
+                if msg.note in keys:
+                    note_length = absolute_time + msg.time - keys[msg.note]
+                    length_in_32s = math.ceil(note_length / ticks_per_beat * Song.SDQNotesPerBeat)
+                    time_in_32s = math.ceil(keys[msg.note] / ticks_per_beat * Song.SDQNotesPerBeat)
+                    if length_in_32s >= Song.MinNoteLength32s:
+                        notes.append(Note(msg.note, time_in_32s, length_in_32s))
+                        keys.pop(msg.note)
+                    absolute_time += msg.time
+
+        # Notes are made as they end so overlapping notes are out of order
+        notes.sort(key=lambda n: n.time)
+        return notes
+
+    def analyse_tracks(self):
+        """Compute statistics for every cached midi track in one pass over its notes.
+        Each entry of track_stats holds the note count, pitch range, fraction of notes inside
+        the staff's playable range, maximum polyphony, notes per bar and if it is a drum track."""
+        self.track_stats = {}
+        for id, messages in self.midi_tracks.items():
+            notes = Song._get_track_notes(messages, self.ticks_per_beat)
+            num_notes = len(notes)
+            stats = {
+                "num_notes": num_notes,
+                "note_range": (0, 0),
+                "in_range": 0.0,
+                "polyphony": 0,
+                "density": 0.0,
+                "drums": any(msg.channel == Song.DrumChannel for msg in messages if msg.type == "note_on"),
+            }
+            if num_notes > 0:
+                pitches = np.fromiter((n.note for n in notes), dtype=np.int32, count=num_notes)
+                starts = np.fromiter((n.time for n in notes), dtype=np.int64, count=num_notes)
+                ends = starts + np.fromiter((n.length for n in notes), dtype=np.int64, count=num_notes)
+
+                # Count overlapping notes by sweeping note starts and ends, ends sorting first at equal times
+                times = np.concatenate((starts, ends))
+                deltas = np.concatenate((np.ones(num_notes, dtype=np.int32), -np.ones(num_notes, dtype=np.int32)))
+                order = np.lexsort((deltas, times))
+                playable = (pitches >= Note.LowestPlayable) & (pitches < Note.LowestPlayable + Note.NumPlayable)
+                num_bars = max(1.0, (ends.max() - starts.min()) / Note.BarLength)
+
+                stats["note_range"] = (int(pitches.min()), int(pitches.max()))
+                stats["in_range"] = float(np.count_nonzero(playable)) / num_notes
+                stats["polyphony"] = int(np.cumsum(deltas[order]).max())
+                stats["density"] = float(num_notes / num_bars)
+            self.track_stats[id] = stats
+
+    def get_best_track(self) -> int:
+        """Return the id of the track most likely to be the melody: monophonic, playable and busiest."""
+        best_id = 0
+        best_key = None
+        for id, stats in self.track_stats.items():
+            if stats["drums"] or stats["num_notes"] == 0:
+                continue
+            key = (stats["polyphony"] <= 1, stats["in_range"] * stats["num_notes"])
+            if best_key is None or key > best_key:
+                best_id = id
+                best_key = key
+        return best_id
+
+    def set_player_track(self, track_id: int):
+        """Choose the track the player plays, rebuilding notes and backing from the cached midi tracks.
+        The track is clamped to the tracks in the file, which is read again if the song was loaded from the song book."""
+        if not self.midi_tracks and self.path and os.path.exists(self.path):
+            self.from_midi_file(self.path, self.player_track_id)
+        if not self.midi_tracks:
+            self.player_track_id = max(track_id, 0)
+            return
+
+        self.player_track_id = min(max(track_id, 0), len(self.midi_tracks) - 1)
+        self._apply_player_track()
+
+    def _apply_player_track(self):
+        notes = Song._get_track_notes(self.midi_tracks.get(self.player_track_id, []), self.ticks_per_beat)
+        self.backing_tracks = {}
 
         # Add a lead in if the first notes to be played start within a bar
-        if len(self.notes) > 0:
-            if self.notes[0].time < 32:
-                lead_in_32s = 32
-                for note in self.notes:
-                    note.time += lead_in_32s
-                for _, track in enumerate(self.backing_tracks):
-                    for note in self.backing_tracks[track]:
-                        note.time += lead_in_32s
+        lead_in_32s = 32 if len(notes) > 0 and notes[0].time < 32 else 0
+        self.notes = [Note(n.note, n.time + lead_in_32s, n.length) for n in notes] if lead_in_32s else notes
+        for id, messages in self.midi_tracks.items():
+            if id != self.player_track_id and messages:
+                self.backing_tracks[id] = [msg.copy(time=msg.time + lead_in_32s) for msg in messages] if lead_in_32s else list(messages)
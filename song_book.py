@@ -71,6 +71,9 @@ class SongBook:
         if not hasattr(self, "output_latency_ms"): self.output_latency_ms = 0
         if not hasattr(self, "player_instrument"): self.player_instrument = 0  # Default to Acoustic Grand Piano
         if not hasattr(self, "career"): self.career = Career()
+        if not hasattr(self, "library_folders"): self.library_folders: dict[str, str] = {}
+        if not hasattr(self, "library_index"): self.library_index: dict[str, tuple] = {}
+        if not hasattr(self, "library_removed"): self.library_removed: dict[str, tuple] = {}
 
     def sort(self):
         sorted(self.albums, key=lambda album: album.get_max_score())
@@ -105,6 +108,26 @@ class SongBook:
             self.albums[0].get_song[0]
         return None
 
+    def find_song_by_hash(self, content_hash: str) -> Song:
+        """Return a song from any album with exactly the same note data using each album's hash index."""
+        for a in self.albums:
+            song = a.find_song_by_hash(content_hash)
+            if song is not None:
+                return song
+        return None
+
+    def add_update_song(self, song: Song, album_name: str) -> bool:
+        """Add or update a song in an album, returning True if it already existed in the songbook.
+        Songs with the same note data as a song in another album are duplicates and are not added."""
+        album = self.add_album(album_name)
+        content_hash = song.content_hash
+        if content_hash and album.find_song_by_hash(content_hash) is None:
+            existing = self.find_song_by_hash(content_hash)
+            if existing is not None:
+                print(f"Song book already contains {song.get_name()} as {existing.get_name()}")
+                return True
+        return album.add_update_song(song)
+
     def find_song(self, title:str, artist:str) -> Song:
         """Return a song from any album where the title and artist matches."""
         for a in self.albums:
@@ -122,12 +145,24 @@ class SongBook:
             existing = a
         return existing
 
-    def add_update_from_midi(self, midi_path: Path, track_id: int, album_name:str):
-        album = self.get_album_by_name(album_name)
-        if album is None:
-            album = self.add_album(album_name)
+    def delete_song_by_path(self, path: str) -> bool:
+        """Remove every song that was read from a midi file path, returning True if any were removed."""
+        removed = False
+        for album in self.albums:
+            songs = [s for s in album.songs if str(s.path) != path]
+            if len(songs) != len(album.songs):
+                album.songs = songs
+                album.index_songs()
+                removed = True
+        return removed
 
+    def add_library_folder(self, folder: str, album_name: str):
+        """Library folders are kept in sync with an album by the LibraryWatcher."""
+        self.library_folders[os.path.normpath(folder)] = album_name
+
+    def add_update_from_midi(self, midi_path: Path, track_id: int, album_name:str):
+        midi_path = Path(midi_path)
         if midi_path.exists():
             new_song = Song()
             new_song.from_midi_file(midi_path, track_id)
-            album.add_update_song(new_song)
+            self.add_update_song(new_song, album_name)
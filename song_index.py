@@ -0,0 +1,139 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from key_signature import KeySignature, BarAccidentals
+from note import Note
+from song import Song
+
+
+def analyse_song(song: Song) -> dict:
+    """Return the difficulty metrics of a song's player notes as an index row."""
+    row = {
+        "name": song.get_name(),
+        "path": str(song.path),
+        "album": "",
+        "key": song.key_signature,
+        "tempo_bpm": round(float(song.tempo_bpm), 2),
+        "num_notes": len(song.notes),
+        "note_min": 0,
+        "note_max": 0,
+        "density": 0.0,
+        "fastest": 0,
+        "accidentals": 0,
+    }
+    num_notes = len(song.notes)
+    if num_notes == 0:
+        return row
+
+    pitches = np.fromiter((n.note for n in song.notes), dtype=np.int32, count=num_notes)
+    starts = np.fromiter((n.time for n in song.notes), dtype=np.int64, count=num_notes)
+    lengths = np.fromiter((n.length for n in song.notes), dtype=np.int64, count=num_notes)
+    num_bars = max(1.0, float((starts + lengths).max() - starts.min()) / Note.BarLength)
+
+    # Count notes drawn with an accidental by the notation layout, which leaves out notes off the staff
+    key_signature = KeySignature()
+    try:
+        key_signature.set(song.key_signature)
+    except KeyError:
+        print(f"Unknown key signature {song.key_signature} in {song.get_name()}, using C")
+    playable_notes = range(Note.LowestPlayable, Note.LowestPlayable + Note.NumPlayable)
+    bar_accidentals = BarAccidentals(key_signature, playable_notes)
+    accidentals = 0
+    for note in song.notes:
+        if note.note in playable_notes and bar_accidentals.get(note.note, note.time)[1] is not None:
+            accidentals += 1
+
+    row["note_min"] = int(pitches.min())
+    row["note_max"] = int(pitches.max())
+    row["density"] = round(num_notes / num_bars, 3)
+    row["fastest"] = Note.get_quantized_length(int(lengths.min()))[0]
+    row["accidentals"] = accidentals
+    return row
+
+
+def _analyse_midi_file(job: tuple) -> dict:
+    """Process pool worker reading one midi file with the same parsing as the game."""
+    path, track_id, album_name = job
+    song = Song()
+    try:
+        song.from_midi_file(path, track_id)
+    except Exception as e:
+        print(f"Unable to read midi file {path}: {e}")
+        return None
+    row = analyse_song(song)
+    row["album"] = album_name
+    return row
+
+
+class SongIndex:
+    """A compact table of per-song metrics the menu can search and sort without reading any songs.
+    Rows are stored as lists in Fields order to keep the file small and quick to load."""
+    PATH = os.path.join("ext", "song_index.json")
+    Version = 2 # Increment when a metric changes so indexes written before are analysed again
+    Fields = ["name", "path", "album", "key", "tempo_bpm", "num_notes", "note_min", "note_max", "density", "fastest", "accidentals"]
+
+    def __init__(self, rows: list = None):
+        self.rows: list[dict] = rows or []
+
+    @staticmethod
+    def load(path: str = PATH):
+        if not os.path.exists(path):
+            return SongIndex()
+        with open(path, "r") as index_file:
+            data = json.load(index_file)
+        if data.get("version", 1) != SongIndex.Version:
+            print(f"The song index {path} is out of date, rebuild it with: python -m library analyse")
+            return SongIndex()
+        fields = data["fields"]
+        return SongIndex([dict(zip(fields, values)) for values in data["rows"]])
+
+    def save(self, path: str = PATH):
+        data = {
+            "version": SongIndex.Version,
+            "fields": SongIndex.Fields,
+            "rows": [[row[f] for f in SongIndex.Fields] for row in self.rows],
+        }
+        with open(path, "w") as index_file:
+            json.dump(data, index_file, separators=(",", ":"))
+
+    def search(self, text: str = "", **ranges) -> list[dict]:
+        """Return rows whose name or album contains text and whose metrics fall in inclusive ranges,
+        eg: search("Beatles", tempo_bpm=(60, 100), fastest=(4, 32))"""
+        text = text.lower()
+        found = []
+        for row in self.rows:
+            if text and text not in row["name"].lower() and text not in row["album"].lower():
+                continue
+            if all(r[0] <= row[field] <= r[1] for field, r in ranges.items()):
+                found.append(row)
+        return found
+
+    @staticmethod
+    def build(songbook=None, folder: str = None, max_workers: int = None):
+        """Analyse every song in the songbook, or every midi file in a folder, across all CPU cores.
+        Songs read from files are parsed again in worker processes, generated songs are analysed in place."""
+        rows = []
+        jobs = []
+        if folder is not None:
+            for file in sorted(os.listdir(folder)):
+                if file.lower().endswith((".mid", ".midi")):
+                    jobs.append((os.path.join(folder, file), Song.AutoTrack, os.path.basename(os.path.normpath(folder))))
+        elif songbook is not None:
+            for album in songbook.albums:
+                for song in album.songs:
+                    if song.path and os.path.exists(song.path):
+                        jobs.append((str(song.path), song.player_track_id, album.name))
+                    else:
+                        row = analyse_song(song)
+                        row["album"] = album.name
+                        rows.append(row)
+
+        if len(jobs) > 0:
+            max_workers = max_workers or os.cpu_count() or 1
+            chunksize = max(1, len(jobs) // (max_workers * 4))
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                rows.extend(r for r in pool.map(_analyse_midi_file, jobs, chunksize=chunksize) if r is not None)
+        return SongIndex(rows)
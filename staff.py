@@ -3,6 +3,7 @@ from gamejam.gui import Gui
 from gamejam.texture import TextureManager
 
 from key_signature import KeySignature
+from note import Note
 
 
 class Staff:
@@ -13,8 +14,8 @@ class Staff:
        """
     ScoreBoxTexture = "score_zone.png"
     ScoreFadeThreshold = 0.95
-    OriginNote = 40 # Lowest note playable, E2 on Piano, E String on Guitar
-    NumNotes = 48
+    OriginNote = Note.LowestPlayable
+    NumNotes = Note.NumPlayable
     BaseAlphaNote = 0.35
     BaseAlphaScore = 0.33
     NoteColours = [[31, 130, 180, 1.0],    [166, 206, 227, 1.0],    [51, 166, 44, 1.0],  [178, 223, 138, 1.0], # C, Db, D, Eb 
@@ -0,0 +1,177 @@
+"""Visual diff of the full window note renderer against the instanced and strip renderers.
+
+This script plays the same procedural song through a NoteRender, a NoteInstanceRender and a
+NoteStripRender, drawing each into its own offscreen framebuffer every frame, reading them back
+and printing the largest colour difference from NoteRender and the number of pixels that differ.
+The window closes and the script exits non zero if any frame differs by more than one colour level.
+
+NoteStripRender copies each bar to the window at a whole pixel offset, up to half a pixel from
+where NoteRender draws its notes, which can also draw a thin edge a pixel thinner. Its pixels are
+compared with the range of the NoteRender pixels one either side in x and y, and a frame only differs
+when more than MaxSnapPixels of one SnapTile square are outside that range. A bar that is not drawn
+again when it should be differs by whole note heads, filling the tiles they cover.
+
+The song is the last World Tour set, the densest procedural music with beams, ties and
+accidentals in every key, generated from a fixed seed so every run draws the same notes.
+Measured with Mesa llvmpipe (OpenGL 4.5 core) at 1280x720 over 600 frames: largest
+difference 1 for NoteInstanceRender, no frames differ. NoteStripRender has at most 16
+differing pixels in one tile, no frames differ, while never drawing a bar again fails
+172 of the first 200 frames with 256.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import numpy.random as rng
+from OpenGL.GL import (
+    glGenTextures, glBindTexture, glTexImage2D, glTexParameteri,
+    glGenFramebuffers, glBindFramebuffer, glFramebufferTexture2D,
+    glGetIntegerv, glViewport, glClearColor, glClear, glReadPixels,
+    GL_TEXTURE_2D, GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE, GL_NEAREST, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER,
+    GL_FRAMEBUFFER, GL_FRAMEBUFFER_BINDING, GL_COLOR_ATTACHMENT0, GL_COLOR_BUFFER_BIT, GL_VIEWPORT,
+)
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from gamejam.gamejam import GameJam
+from gamejam.gui import Gui
+
+from note_instance_render import NoteInstanceRender
+from note_render import NoteRender
+from note_strip_render import NoteStripRender
+from notes import Notes
+from procedural_songs import regenerate_set
+from song_book import SongBook
+from staff import Staff
+
+
+class NoteRenderDiff(GameJam):
+    """Draw one song with every note renderer side by side offscreen and compare the pixels with NoteRender."""
+    NumFrames = 600
+    MaxDifference = 1 # Colour levels out of 255, the layers are combined as floats but read back as bytes
+    FrameTime = 1.0 / 60.0
+    MusicSpeed = 16.0 # 32nd notes per second, the whole song scrolls past in NumFrames
+    Tier = 5
+    Set = 5
+    Seed = 1
+    SnapTile = 16 # Pixels along each side of the squares the differing pixels of a snapped render are counted in
+    MaxSnapPixels = 24 # Per tile, an edge drawn one pixel thinner crosses at most SnapTile, a missing note head fills the tile
+
+    def __init__(self):
+        super(NoteRenderDiff, self).__init__()
+        self.name = "NoteRenderDiff"
+        self.frame = 0
+        self.music_time = 0.0
+        self.worst_difference = {}
+        self.worst_tile = {}
+        self.failed_frames = {}
+
+    def prepare(self):
+        super().prepare()
+        self.songbook = SongBook()
+        self.staff = Staff()
+        staff_gui = Gui("note_render_diff", self.graphics, self.gui.debug_font, False)
+        self.staff.prepare(staff_gui, self.textures)
+
+        rng.seed(NoteRenderDiff.Seed)
+        song = regenerate_set(NoteRenderDiff.Tier, NoteRenderDiff.Set)
+        self.staff.key_signature.set(song.key_signature, self.staff.get_note_positions())
+
+        # Each render with how many pixels snapping can move its notes
+        self.renders = []
+        for render_type, snap in ((NoteRender, 0), (NoteInstanceRender, 0), (NoteStripRender, 1)):
+            render = render_type(self.graphics, self.staff, self.songbook)
+            notes = Notes(self.graphics, render, self.staff, self.staff.get_note_positions())
+            notes.assign_notes(song.notes)
+            self.renders.append((render_type.__name__, notes, self._create_target(), snap))
+            self.worst_difference[render_type.__name__] = 0
+            self.worst_tile[render_type.__name__] = 0
+            self.failed_frames[render_type.__name__] = 0
+
+    def _create_target(self) -> int:
+        width, height = self.window_width, self.window_height
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        return framebuffer
+
+    def _draw(self, notes: Notes, framebuffer: int) -> np.ndarray:
+        """Draw the notes into a cleared framebuffer and return the pixels."""
+        previous_framebuffer = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        previous_viewport = [int(v) for v in glGetIntegerv(GL_VIEWPORT)]
+        width, height = self.window_width, self.window_height
+
+        glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+        glViewport(0, 0, width, height)
+        glClearColor(0.0, 0.0, 0.0, 0.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+        notes.draw(NoteRenderDiff.FrameTime, self.music_time, Staff.NoteWidth32nd)
+        pixels = glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_framebuffer)
+        glViewport(*previous_viewport)
+        return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 4).astype(np.int16)
+
+    @staticmethod
+    def _get_difference(reference: np.ndarray, image: np.ndarray, snap: int) -> np.ndarray:
+        """Return how far each pixel is outside the range of the reference pixels up to snap pixels away in x and y."""
+        height, width = reference.shape[:2]
+        padded = np.pad(reference, ((snap, snap), (snap, snap), (0, 0)), mode="edge")
+        shifted = [padded[y:y + height, x:x + width] for y in range(snap * 2 + 1) for x in range(snap * 2 + 1)]
+        low = np.minimum.reduce(shifted)
+        high = np.maximum.reduce(shifted)
+        return np.maximum(np.maximum(low - image, image - high), 0)
+
+    @staticmethod
+    def _get_tile_counts(different: np.ndarray) -> np.ndarray:
+        """Return the number of differing pixels in each SnapTile square of the image."""
+        tile = NoteRenderDiff.SnapTile
+        height, width = different.shape
+        padded = np.pad(different, ((0, -height % tile), (0, -width % tile)))
+        return padded.reshape(padded.shape[0] // tile, tile, padded.shape[1] // tile, tile).sum(axis=(1, 3))
+
+    def update(self, dt):
+        self.music_time += NoteRenderDiff.FrameTime * NoteRenderDiff.MusicSpeed
+        images = [self._draw(notes, framebuffer) for _, notes, framebuffer, _ in self.renders]
+
+        for (name, _, _, snap), image in zip(self.renders[1:], images[1:]):
+            difference = NoteRenderDiff._get_difference(images[0], image, snap)
+            different = difference.max(axis=2) > NoteRenderDiff.MaxDifference
+            max_difference = int(difference.max())
+            num_different = int(np.count_nonzero(different))
+            max_tile = int(NoteRenderDiff._get_tile_counts(different).max())
+            self.worst_difference[name] = max(self.worst_difference[name], max_difference)
+            self.worst_tile[name] = max(self.worst_tile[name], max_tile)
+            if max_tile > (NoteRenderDiff.MaxSnapPixels if snap > 0 else 0):
+                self.failed_frames[name] += 1
+                print(f"{name} frame {self.frame} at music time {round(self.music_time, 2)}: {num_different} pixels differ, "
+                      f"{max_tile} in one tile, largest difference {max_difference}")
+
+        self.frame += 1
+        if self.frame >= NoteRenderDiff.NumFrames:
+            self.quit()
+
+
+def main():
+    diff = NoteRenderDiff()
+    diff.prepare()
+    diff.begin()
+
+    reference = diff.renders[0][0]
+    for name, _, _, _ in diff.renders[1:]:
+        print(f"Compared {name} with {reference} over {diff.frame} frames, largest difference {diff.worst_difference[name]}, "
+              f"at most {diff.worst_tile[name]} differing pixels in one tile, {diff.failed_frames[name]} frames differ.")
+    return 1 if sum(diff.failed_frames.values()) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
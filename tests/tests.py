@@ -1 +1,221 @@
-# Start a midimaster, save a songbook and load it again
\ No newline at end of file
+"""Unit tests of the song data and notation modules.
+
+Run from the repository root with: python -m unittest tests/tests.py
+"""
+
+import importlib.util
+import sys
+import unittest
+from pathlib import Path
+
+from mido import Message
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from key_signature import KeySignature, BarAccidentals
+from note import Note
+from song import Song
+from song_index import analyse_song
+
+# Modules that draw with gamejam are only tested where it is installed
+HasGameJam = importlib.util.find_spec("gamejam") is not None
+
+
+def get_overlapping_messages() -> list:
+    """A track in 32nd note ticks with a note held while 24 short notes start and end over it."""
+    messages = [Message("note_on", note=60, velocity=100, time=0)]
+    for i in range(24):
+        messages.append(Message("note_on", note=72, velocity=100, time=8))
+        messages.append(Message("note_off", note=72, velocity=0, time=4))
+    messages.append(Message("note_off", note=60, velocity=0, time=0))
+    return messages
+
+
+class KeySignatureTest(unittest.TestCase):
+    GSharpKeys = ["A", "E", "B", "F#", "C#", "F#m", "C#m", "G#m", "D#m", "A#m"]
+    GFlatKeys = ["Db", "Gb", "Cb", "Bbm", "Ebm", "Abm"]
+
+    def test_g_sharp_keys(self):
+        """G# is drawn on the G line without an accidental and G natural is drawn with a natural."""
+        key_signature = KeySignature()
+        for key in KeySignatureTest.GSharpKeys:
+            key_signature.set(key)
+            self.assertEqual(key_signature.get_accidental(68, True), (67, None), key)
+            self.assertEqual(key_signature.get_accidental(67, True), (67, 0), key)
+
+    def test_g_flat_keys(self):
+        """Gb is drawn on the G line without an accidental and G natural is drawn with a natural."""
+        key_signature = KeySignature()
+        for key in KeySignatureTest.GFlatKeys:
+            key_signature.set(key)
+            self.assertEqual(key_signature.get_accidental(66, False), (67, None), key)
+            self.assertEqual(key_signature.get_accidental(67, False), (67, 0), key)
+
+    def test_g_natural_keys(self):
+        """Keys without G sharp or flat draw G# with a sharp and G natural without an accidental."""
+        key_signature = KeySignature()
+        for key in ["C", "G", "D", "F", "Am"]:
+            key_signature.set(key)
+            self.assertEqual(key_signature.get_accidental(68, True), (67, 1), key)
+            self.assertEqual(key_signature.get_accidental(67, True), (67, None), key)
+
+    def _get_scale(self, key: str, notes: list) -> list:
+        key_signature = KeySignature()
+        key_signature.set(key)
+        accidentals = BarAccidentals(key_signature, range(Note.LowestPlayable, Note.LowestPlayable + Note.NumPlayable))
+        return [accidentals.get(note, time * 4) for time, note in enumerate(notes)]
+
+    def _check_scales(self, keys: list, steps: list):
+        """Ascending and descending scales of each key are drawn on consecutive lines without accidentals."""
+        for key in keys:
+            tonic = KeySignature.TonicToIndex[key[0]] + key.count('#') - key.count('b') + 60
+            scale = [tonic + sum(steps[:i]) for i in range(len(steps) + 1)]
+            for notes in [scale, scale[::-1]]:
+                drawn = self._get_scale(key, notes)
+                self.assertEqual([accidental for _, accidental in drawn], [None] * len(notes), key)
+                lines = [KeySignature.LookupTableKeyToIndex[n] + 12 * o for o in range(10) for n in "CDEFGAB"]
+                line_ids = [lines.index(note_drawn) for note_drawn, _ in drawn]
+                self.assertEqual([b - a for a, b in zip(line_ids, line_ids[1:])], [1 if notes is scale else -1] * len(steps), key)
+
+    def test_major_scales(self):
+        self._check_scales(["C", "G", "D", "A", "E", "B", "F#", "C#", "F", "Bb", "Eb", "Ab", "Db", "Gb", "Cb"], [2, 2, 1, 2, 2, 2, 1])
+
+    def test_minor_scales(self):
+        self._check_scales(["Am", "Em", "Bm", "F#m", "C#m", "G#m", "D#m", "A#m", "Dm", "Gm", "Cm", "Fm", "Bbm", "Ebm", "Abm"], [2, 1, 2, 2, 1, 2, 2])
+
+    def test_key_spelling(self):
+        """Notes in the key signature keep its spelling whichever way the melody moves."""
+        self.assertEqual(self._get_scale("G", [67, 66, 64]), [(67, None), (65, None), (64, None)])
+        self.assertEqual(self._get_scale("F", [65, 67, 69, 70, 72]), [(65, None), (67, None), (69, None), (71, None), (72, None)])
+        self.assertEqual(self._get_scale("E", [64, 63, 61]), [(64, None), (62, None), (60, None)])
+
+    def test_chromatic_notes(self):
+        """Black keys outside the key are sharp going up and flat coming down, and sharp at the top of the staff."""
+        self.assertEqual(self._get_scale("C", [60, 61, 62, 61, 60]), [(60, None), (60, 1), (62, None), (62, -1), (60, 0)])
+        self.assertEqual(self._get_scale("G", [67, 68, 70, 68]), [(67, None), (67, 1), (69, 1), (69, -1)])
+        top = Note.LowestPlayable + Note.NumPlayable - 1
+        self.assertEqual(self._get_scale("C", [top - 1, top]), [(top - 1, None), (top - 1, 1)])
+        self.assertEqual(self._get_scale("Eb", [top]), [(top - 1, 1)])
+
+
+class SongTest(unittest.TestCase):
+    def test_overlapping_notes_sorted(self):
+        """Notes are ordered by start time even though the held note ends last."""
+        notes = Song._get_track_notes(get_overlapping_messages(), Song.SDQNotesPerBeat)
+        self.assertEqual(len(notes), 25)
+        self.assertEqual((notes[0].note, notes[0].time), (60, 0))
+        self.assertEqual([n.time for n in notes], sorted(n.time for n in notes))
+
+
+class SongIndexTest(unittest.TestCase):
+    def _get_song(self, key: str, notes: list) -> Song:
+        """A song of quarter notes in a key, four to a bar."""
+        song = Song()
+        song.key_signature = key
+        song.notes = [Note(note, time * 8, 8) for time, note in enumerate(notes)]
+        return song
+
+    def test_accidentals_in_key(self):
+        """Melodies using only the notes of their key have no accidentals."""
+        self.assertEqual(analyse_song(self._get_song("G", [67, 66, 64, 62] * 4))["accidentals"], 0)
+        self.assertEqual(analyse_song(self._get_song("F", [65, 67, 69, 70, 72, 70, 69, 67, 65]))["accidentals"], 0)
+        self.assertEqual(analyse_song(self._get_song("E", [64, 63, 61, 59, 61, 63, 64]))["accidentals"], 0)
+
+    def test_accidentals_chromatic(self):
+        """A chromatic line counts each accidental drawn, and each lasts until the end of its bar."""
+        self.assertEqual(analyse_song(self._get_song("C", [60, 61, 62, 63, 64, 63, 62, 61, 60]))["accidentals"], 4)
+        self.assertEqual(analyse_song(self._get_song("G", [67, 65, 65, 66]))["accidentals"], 2)
+
+
+class NoteRenderRecorder:
+    """Stands in for NoteRender, keeping the notes assigned since the last reset."""
+    def __init__(self):
+        self.assigned = []
+
+    def reset(self):
+        self.assigned = []
+
+    def assign(self, note):
+        self.assigned.append(note)
+
+    def rebase(self, time):
+        for note in self.assigned:
+            note.time -= time
+
+
+@unittest.skipUnless(HasGameJam, "gamejam is not installed")
+class NotesTest(unittest.TestCase):
+    def _get_notes(self, source_notes: list):
+        """Make Notes for the source notes without the barline sprites that need a window."""
+        from types import SimpleNamespace
+        from notes import Notes
+        notes = Notes.__new__(Notes)
+        notes.note_render = NoteRenderRecorder()
+        notes.source_notes = source_notes
+        notes.layout_key = ""
+        notes.recording = None
+        notes.loop_notes = None
+        notes.num_barlines = 0
+        notes.bartimes = []
+        notes.note_positions = {note: (note - 60) * 0.0275 for note in range(KeySignature.NumMidiNotes)}
+        notes.staff = SimpleNamespace(key_signature=KeySignature())
+        notes.feed_ahead = 64
+        notes.rewind()
+        return notes
+
+    def _play(self, notes, start_time: int, end_time: int):
+        for music_time in range(start_time, end_time):
+            notes.layout_ahead(music_time)
+            notes.add_notes_to_render(music_time)
+
+    def test_held_notes_overlapping(self):
+        """Seeking into a held note that overlaps shorter notes restores it as sounding."""
+        notes = self._get_notes(Song._get_track_notes(get_overlapping_messages(), Song.SDQNotesPerBeat))
+        self.assertEqual(notes._get_held_notes(100), {60: 288})
+
+    def _get_loop_pitch(self, time: int) -> int:
+        """The pitch of the looped source notes of _get_looped_notes at any time after the loop start."""
+        return 60 + ((256 + (time - 256) % 128) // 8) % 12
+
+    def _get_looped_notes(self):
+        notes = self._get_notes([Note(60 + (time // 8) % 12, time, 8) for time in range(0, 2048, 8)])
+        notes.set_loop(256, 384)
+        return notes
+
+    def test_loop_next_pass_assigned(self):
+        """Before the first wrap the notes after the loop end are the next pass, assigned as far ahead as any others."""
+        notes = self._get_looped_notes()
+        self._play(notes, 0, 384)
+        after_end = [n for n in notes.note_render.assigned if n.time >= 384]
+        self.assertEqual([n.time for n in after_end], list(range(384, 383 + notes.feed_ahead, 8)))
+        self.assertEqual([n.note for n in after_end], [self._get_loop_pitch(n.time) for n in after_end])
+
+    def test_loop_restart_rebases(self):
+        """A wrap moves the assigned notes back a loop length without assigning any, so every pass follows seamlessly."""
+        notes = self._get_looped_notes()
+        self._play(notes, 0, 384)
+        for _ in range(2):
+            num_assigned = len(notes.note_render.assigned)
+            notes.loop_restart()
+            self.assertEqual(len(notes.note_render.assigned), num_assigned)
+            self._play(notes, 256, 384)
+        looped = [n for n in notes.note_render.assigned if n.time >= 256]
+        self.assertEqual([n.time for n in looped], list(range(256, 383 + notes.feed_ahead, 8)))
+        self.assertEqual([n.note for n in looped], [self._get_loop_pitch(n.time) for n in looped])
+
+    def test_clear_loop_after_restart(self):
+        """Clearing a loop that has restarted lays out the notes after the end of the loop."""
+        notes = self._get_notes([Note(60 + (time // 8) % 12, time, 8) for time in range(0, 2048, 8)])
+        notes.set_loop(256, 384)
+        self._play(notes, 0, 384)
+        notes.loop_restart()
+        self._play(notes, 256, 384)
+        notes.clear_loop(384)
+        self._play(notes, 384, 1024)
+        times = [n.time for n in notes.note_render.assigned if not n.is_rest()]
+        self.assertEqual(min(times), 384)
+        self.assertGreaterEqual(max(times), 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()